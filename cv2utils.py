@@ -1,12 +1,190 @@
 import cv2
 import numpy as np
 import imutils
+import json
 import sys
 import math
-import urllib
+import os
+import requests
 
-class CustomUserAgentURLopener(urllib.FancyURLopener):
-  version = 'Mozilla/5.0'
+from pokeutil import writeAtomically
+
+class ImageTooLargeException(Exception):
+  pass
+
+class NotAnImageException(Exception):
+  pass
+
+# Downloads attachments over a shared keep-alive session, so consecutive
+# downloads from the CDN reuse connections.  The body is streamed into a
+# single buffer and rejected as soon as it's over max_bytes, and anything that
+# isn't an image is rejected before its body is read at all.
+class imageDownloader:
+  def __init__(self, max_bytes=10 * 1024 * 1024, timeout=15, chunk_size=64 * 1024):
+    self.max_bytes = max_bytes
+    self.timeout = timeout
+    self.chunk_size = chunk_size
+    self.session = requests.Session()
+    self.session.headers['User-Agent'] = 'Mozilla/5.0'
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16)
+    self.session.mount('http://', adapter)
+    self.session.mount('https://', adapter)
+
+  # Returns the raw bytes of the image as a bytearray
+  def fetchBytes(self, url):
+    resp = self.session.get(url, stream=True, timeout=self.timeout)
+    try:
+      resp.raise_for_status()
+
+      ctype = resp.headers.get('Content-Type', '')
+      if ctype and not ctype.startswith('image/'):
+        raise NotAnImageException('Expected an image but got ' + ctype)
+
+      length = resp.headers.get('Content-Length')
+      if length is not None and int(length) > self.max_bytes:
+        raise ImageTooLargeException('Image is ' + length + ' bytes')
+
+      buf = bytearray()
+      for chunk in resp.iter_content(self.chunk_size):
+        buf.extend(chunk)
+        # Content-Length can lie or be missing, so check as we go too
+        if len(buf) > self.max_bytes:
+          raise ImageTooLargeException('Image is over ' + str(self.max_bytes) + ' bytes')
+      return buf
+    finally:
+      # Returns the connection to the pool, or drops it if we stopped reading
+      # partway through
+      resp.close()
+
+  def fetch(self, url):
+    return cv2utils.bytesToImage(self.fetchBytes(url))
+
+# Holds the grayscale and edge-detected versions of a template image, so that
+# they're computed once at startup instead of once per screenshot.  Also keeps
+# a pyramid of downsampled edge maps (level n is 1/2^n of the full size) for
+# matching against downsampled screenshots.
+class scalingTemplate:
+  def __init__(self, image, name=None, levels=3):
+    self.name = name
+    if len(image.shape) > 2:
+      self.gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    else:
+      self.gray = image
+    self.edged = cv2.Canny(self.gray, 50, 200)
+    (self.height, self.width) = self.edged.shape[:2]
+
+    self.pyramid = [self.edged]
+    for level in range(1, levels):
+      factor = 2 ** level
+      size = (self.width // factor, self.height // factor)
+      # Edge maps of tiny templates are just noise
+      if size[0] < 8 or size[1] < 8:
+        break
+      small = cv2.resize(self.gray, size, interpolation=cv2.INTER_AREA)
+      self.pyramid.append(cv2.Canny(small, 50, 200))
+
+  @classmethod
+  def fromFile(cls, filename, levels=3):
+    image = cv2.imread(filename)
+    if image is None:
+      raise IOError('Could not read template image ' + filename)
+    return cls(image, os.path.basename(filename), levels)
+
+  # Lets callers keep passing raw cv2 images where a template is expected
+  @classmethod
+  def wrap(cls, template):
+    if isinstance(template, cls):
+      return template
+    return cls(template)
+
+# Remembers where the templates were found in screenshots of each resolution.
+# People post from a handful of phone models, so most screenshots can be
+# cropped by verifying the remembered boxes instead of searching again.  If a
+# filename is given, the cache is persisted there as JSON.
+class scaleCache:
+  def __init__(self, filename=None):
+    self.filename = filename
+    self.entries = {}
+    if filename and os.path.exists(filename):
+      try:
+        with open(filename, 'r') as fp:
+          self.entries = json.load(fp)
+      except ValueError:
+        # Corrupt cache, start over
+        self.entries = {}
+
+  @staticmethod
+  def key(width, height, templates):
+    return '%dx%d:%s' % (width, height, ','.join([str(t.name) for t in templates]))
+
+  # Returns the remembered boxes, or None
+  def get(self, width, height, templates):
+    boxes = self.entries.get(self.key(width, height, templates))
+    if boxes is None:
+      return None
+    return [((b[0][0], b[0][1]), (b[1][0], b[1][1])) for b in boxes]
+
+  def put(self, width, height, templates, boxes):
+    key = self.key(width, height, templates)
+    if self.entries.get(key) == [[list(b[0]), list(b[1])] for b in boxes]:
+      return
+    self.entries[key] = [[list(b[0]), list(b[1])] for b in boxes]
+    self.save()
+
+  def save(self):
+    if not self.filename:
+      return
+    # Scans may run on several threads at once, so save a snapshot
+    entries = dict(self.entries)
+    writeAtomically(self.filename, json.dumps(entries, indent=2, sort_keys=True))
+
+# Holds what preprocessing needs for each image: a CLAHE instance and
+# scratch buffers for the intermediate images, which OpenCV writes into via
+# dst= instead of allocating new arrays.  Buffers only ever grow, so once a
+# context has seen the biggest image, processing more images allocates
+# nothing but each method's result.
+#
+# Contexts aren't thread safe; use one per worker thread.  Results are always
+# newly allocated, so they can outlive the next call.
+class preprocessContext:
+  def __init__(self, clipLimit = 3., tileGridSize = (8,8)):
+    self.clahe = cv2.createCLAHE(clipLimit=clipLimit, tileGridSize=tileGridSize)
+    self.buffers = {}
+
+  # A scratch array of the given shape.  It's overwritten by the next call
+  # for the same name.
+  def buffer(self, name, shape):
+    size = int(np.prod(shape))
+    buf = self.buffers.get(name)
+    if buf is None or buf.size < size:
+      buf = self.buffers[name] = np.empty(size, np.uint8)
+    return buf[:size].reshape(shape)
+
+  # Same as cv2.resize(image, (0,0), fx=scale, fy=scale), into a scratch
+  # buffer unless out is given
+  def resize(self, image, scale, interpolation, out = None):
+    (height, width) = image.shape[:2]
+    size = (int(round(width * scale)), int(round(height * scale)))
+    if out is None:
+      out = self.buffer('resize', (size[1], size[0]) + image.shape[2:])
+    return cv2.resize(image, size, dst=out, interpolation=interpolation)
+
+  def gray(self, image, out = None):
+    if out is None:
+      out = self.buffer('gray', image.shape[:2])
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=out)
+
+  # Same as cv2utils.increaseContrast, into out if it's given
+  def increaseContrast(self, image, out = None):
+    lab = cv2.cvtColor(image, cv2.COLOR_BGR2LAB, dst=self.buffer('lab', image.shape))
+    l = cv2.extractChannel(lab, 0, dst=self.buffer('l', image.shape[:2]))
+    l2 = self.clahe.apply(l, dst=self.buffer('l2', image.shape[:2]))
+    cv2.insertChannel(l2, lab, 0)
+    return cv2.cvtColor(lab, cv2.COLOR_LAB2BGR, dst=out)
+
+  # Same as cv2utils.increaseGrayContrast
+  def increaseGrayContrast(self, gray):
+    return self.clahe.apply(gray)
 
 class cv2utils:
   # From https://stackoverflow.com/questions/19363293/whats-the-fastest-way-to-increase-color-image-contrast-with-opencv-in-python-c/44569460#44569460
@@ -19,28 +197,50 @@ class cv2utils:
     lab = cv2.merge((l2,a,b))  # merge channels
     return cv2.cvtColor(lab, cv2.COLOR_LAB2BGR)  # convert from LAB to BGR
 
+  # CLAHE on an image that's already grayscale.  Gives OCR the same thing as
+  # increaseContrast followed by a grayscale conversion, without going through
+  # LAB and back.
+  @staticmethod
+  def increaseGrayContrast(gray):
+    clahe = cv2.createCLAHE(clipLimit=3., tileGridSize=(8,8))
+    return clahe.apply(gray)
+
+  downloader = None
+
   # From https://www.pyimagesearch.com/2015/03/02/convert-url-to-image-with-pyth
   @staticmethod
   def urlToImage(url):
-    uo = CustomUserAgentURLopener()
-    resp = uo.open(url)
-    image = np.asarray(bytearray(resp.read()), dtype="uint8")
-    image = cv2.imdecode(image, cv2.IMREAD_COLOR)
+    if cv2utils.downloader is None:
+      cv2utils.downloader = imageDownloader()
+    return cv2utils.downloader.fetch(url)
+
+  # Decodes an encoded image without copying the buffer
+  @staticmethod
+  def bytesToImage(buf):
+    image = cv2.imdecode(np.frombuffer(buf, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+      raise NotAnImageException('Could not decode image')
     return image
 
   # From https://www.pyimagesearch.com/2015/01/26/multi-scale-template-matching-using-python-opencv/
   @staticmethod
   def scalingMatch(template, image, visualize = False):
-    # convert the template to grayscale and detect edges
-    template = cv2.cvtColor(template, cv2.COLOR_BGR2GRAY)
-    template = cv2.Canny(template, 50, 200)
-    (tH, tW) = template.shape[:2]
+    return cv2utils.multiScalingMatch([template], image, visualize)[0]
+
+  # Matches several templates against one image.  The grayscale conversion,
+  # resizes and edge detection of the image are shared by all of the
+  # templates, so matching two templates costs little more than matching one.
+  # Returns one ((startX, startY), (endX, endY)) box per template, in order.
+  @staticmethod
+  def multiScalingMatch(templates, image, visualize = False):
+    # the templates may be raw images or preprocessed scalingTemplates
+    templates = [scalingTemplate.wrap(t) for t in templates]
 
     # convert the image to grayscale
     gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
 
-    found = None
-    # track the matched region
+    # track the matched region for each template
+    found = [None] * len(templates)
     # loop over the scales of the image
     for scale in np.linspace(0.2, 1.0, 20)[::-1]:
       # resize the image according to the scale, and keep track
@@ -48,31 +248,190 @@ class cv2utils:
       resized = imutils.resize(gray, width = int(gray.shape[1] * scale))
       r = gray.shape[1] / float(resized.shape[1])
 
-      # if the resized image is smaller than the template, then break
-      if resized.shape[0] < tH or resized.shape[1] < tW:
+      # only match the templates that still fit in the resized image. Once
+      # none of them do, there's no point in shrinking it further
+      fits = [i for i, t in enumerate(templates)
+              if resized.shape[0] >= t.height and resized.shape[1] >= t.width]
+      if not fits:
+        break
+
+      # detect edges in the resized, grayscale image once and apply template
+      # matching to find each template in it
+      edged = cv2.Canny(resized, 50, 200)
+      for i in fits:
+        template = templates[i]
+        result = cv2.matchTemplate(edged, template.edged, cv2.TM_CCOEFF)
+        (_, maxVal, _, maxLoc) = cv2.minMaxLoc(result)
+
+        # check to see if the iteration should be visualized
+        if visualize:
+          # draw a bounding box around the detected region
+          clone = np.dstack([edged, edged, edged])
+          cv2.rectangle(clone, (maxLoc[0], maxLoc[1]), (maxLoc[0] + template.width, maxLoc[1] + template.height), (0, 0, 255), 2)
+          cv2.imshow("Visualize", clone)
+          cv2.waitKey(0)
+
+        # if we have found a new maximum correlation value, then update
+        # the bookkeeping variable
+        if found[i] is None or maxVal > found[i][0]:
+          found[i] = (maxVal, maxLoc, r)
+
+    return [cv2utils.foundToBox(f, t) for f, t in zip(found, templates)]
+
+  # A faster alternative to multiScalingMatch for large screenshots.  First
+  # finds the best scale for each template on a downsampled copy of the
+  # image, using the template pyramid.  The edges are blurred at that stage so
+  # that a slightly-off scale still scores well.  Then refines at full
+  # resolution using only the coarse winner and its neighbouring scales,
+  # stopping as soon as a match scores at least the given confidence
+  # (normalized correlation, 0 to 1).  Falls back to multiScalingMatch if the
+  # image is too small to downsample.
+  @staticmethod
+  def coarseToFineMatch(templates, image, confidence = None, level = 1):
+    templates = [scalingTemplate.wrap(t) for t in templates]
+
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    scales = list(np.linspace(0.2, 1.0, 20)[::-1])
+
+    # Templates with shallower pyramids are matched against a less
+    # downsampled image
+    levels = [min(level, len(t.pyramid) - 1) for t in templates]
+    coarseTemplates = [cv2.GaussianBlur(t.pyramid[lvl], (3, 3), 0) for t, lvl in zip(templates, levels)]
+    smalls = {}
+    for lvl in set(levels):
+      factor = 2 ** lvl
+      smalls[lvl] = cv2.resize(gray, (gray.shape[1] // factor, gray.shape[0] // factor), interpolation=cv2.INTER_AREA)
+
+    # Coarse pass
+    coarse = [None] * len(templates)
+    for scale in scales:
+      edges = {}
+      fits = False
+      for i, tmpl in enumerate(coarseTemplates):
+        lvl = levels[i]
+        if lvl not in edges:
+          resized = imutils.resize(smalls[lvl], width = int(smalls[lvl].shape[1] * scale))
+          edges[lvl] = cv2.GaussianBlur(cv2.Canny(resized, 50, 200), (3, 3), 0)
+        edged = edges[lvl]
+        if edged.shape[0] < tmpl.shape[0] or edged.shape[1] < tmpl.shape[1]:
+          continue
+        fits = True
+
+        result = cv2.matchTemplate(edged, tmpl, cv2.TM_CCOEFF_NORMED)
+        (_, maxVal, _, _) = cv2.minMaxLoc(result)
+        if coarse[i] is None or maxVal > coarse[i][0]:
+          coarse[i] = (maxVal, scales.index(scale))
+      if not fits:
         break
 
-      # detect edges in the resized, grayscale image and apply template
-      # matching to find the template in the image
+    if None in coarse:
+      return cv2utils.multiScalingMatch(templates, image)
+
+    # Fine pass: full resolution, coarse winner first.  Resized edge maps are
+    # shared between templates that land on the same scale.
+    edges = {}
+    boxes = []
+    for template, (_, best) in zip(templates, coarse):
+      band = [best] + [idx for idx in (best - 1, best + 1) if 0 <= idx < len(scales)]
+
+      found = None
+      for idx in band:
+        if idx not in edges:
+          resized = imutils.resize(gray, width = int(gray.shape[1] * scales[idx]))
+          edges[idx] = (cv2.Canny(resized, 50, 200), gray.shape[1] / float(resized.shape[1]))
+        (edged, r) = edges[idx]
+        if edged.shape[0] < template.height or edged.shape[1] < template.width:
+          continue
+
+        result = cv2.matchTemplate(edged, template.edged, cv2.TM_CCOEFF)
+        (_, maxVal, _, maxLoc) = cv2.minMaxLoc(result)
+        if found is None or maxVal > found[0]:
+          found = (maxVal, maxLoc, r)
+
+        # The raw correlation can't be compared to a fixed threshold, so
+        # score the matched position again, normalized
+        if confidence is not None:
+          patch = edged[maxLoc[1]:maxLoc[1] + template.height, maxLoc[0]:maxLoc[0] + template.width]
+          score = cv2.matchTemplate(patch, template.edged, cv2.TM_CCOEFF_NORMED)[0][0]
+          if score >= confidence:
+            break
+
+      if found is None:
+        return cv2utils.multiScalingMatch(templates, image)
+      boxes.append(cv2utils.foundToBox(found, template))
+
+    return boxes
+
+  # Re-matches each template in a small region around its box, at the box's
+  # scale.  Returns a (normalized correlation, refined box) pair per template,
+  # or None if a box doesn't fit the template.
+  @staticmethod
+  def scoreMatch(templates, image, boxes):
+    templates = [scalingTemplate.wrap(t) for t in templates]
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+    scored = []
+    for template, ((startX, startY), (endX, endY)) in zip(templates, boxes):
+      r = (endX - startX) / float(template.width)
+      if r <= 0:
+        return None
+      margin = 8 + (endX - startX) // 10
+      (left, top) = (max(0, startX - margin), max(0, startY - margin))
+      (right, bottom) = (min(gray.shape[1], endX + margin), min(gray.shape[0], endY + margin))
+      roi = gray[top:bottom, left:right]
+
+      resized = imutils.resize(roi, width = max(1, int(roi.shape[1] / r)))
+      if resized.shape[0] < template.height or resized.shape[1] < template.width:
+        return None
+      rr = roi.shape[1] / float(resized.shape[1])
+
       edged = cv2.Canny(resized, 50, 200)
-      result = cv2.matchTemplate(edged, template, cv2.TM_CCOEFF)
+      result = cv2.matchTemplate(edged, template.edged, cv2.TM_CCOEFF_NORMED)
       (_, maxVal, _, maxLoc) = cv2.minMaxLoc(result)
 
-      # check to see if the iteration should be visualized
-      if visualize:
-        # draw a bounding box around the detected region
-	clone = np.dstack([edged, edged, edged])
-        cv2.rectangle(clone, (maxLoc[0], maxLoc[1]), (maxLoc[0] + tW, maxLoc[1] + tH), (0, 0, 255), 2)
-        cv2.imshow("Visualize", clone)
-        cv2.waitKey(0)
+      (x, y) = (left + int(maxLoc[0] * rr), top + int(maxLoc[1] * rr))
+      scored.append((maxVal, ((x, y), (x + int(template.width * rr), y + int(template.height * rr)))))
+
+    return scored
+
+  # Finds the rows of dark, unsaturated text in an image, e.g. the lines of an
+  # invite card.  Colored text like the "Get directions" button is left out.
+  # Returns a (top, bottom, left, right) box per line, from top to bottom,
+  # padded a little so OCR has some margin to work with.
+  @staticmethod
+  def textLines(image, maxGray = 180, maxSaturation = 130):
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    saturation = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)[:, :, 1]
+    ink = (gray < maxGray) & (saturation < maxSaturation)
+    (height, width) = ink.shape
 
-      # if we have found a new maximum correlation value, then update
-      # the bookkeeping variable
-      if found is None or maxVal > found[0]:
-        found = (maxVal, maxLoc, r)
+    rows = ink.sum(axis = 1) >= max(2, width * 0.005)
+    bands = []
+    start = None
+    for y in range(height + 1):
+      if y < height and rows[y]:
+        if start is None:
+          start = y
+      elif start is not None:
+        # Anything shorter than this is a smudge or a stray line, not text
+        if y - start >= height * 0.03:
+          bands.append((start, y))
+        start = None
 
+    lines = []
+    for (top, bottom) in bands:
+      columns = np.nonzero(ink[top:bottom].any(axis = 0))[0]
+      pad = max(2, (bottom - top) // 4)
+      lines.append((max(0, top - pad), min(height, bottom + pad),
+                    max(0, columns[0] - pad), min(width, columns[-1] + 1 + pad)))
+    return lines
+
+  # Converts a (maxVal, maxLoc, ratio) match result into a bounding box in
+  # the coordinates of the original image
+  @staticmethod
+  def foundToBox(found, template):
     (_, maxLoc, r) = found
     (startX, startY) = (int(maxLoc[0] * r), int(maxLoc[1] * r))
-    (endX, endY) = (int((maxLoc[0] + tW) * r), int((maxLoc[1] + tH) * r))
+    (endX, endY) = (int((maxLoc[0] + template.width) * r), int((maxLoc[1] + template.height) * r))
 
     return ((startX, startY), (endX, endY))
@@ -0,0 +1,132 @@
+#!/usr/bin/python
+import cv2
+import sys
+import json
+import argparse
+import multiprocessing
+import os
+import time
+import traceback
+
+from os.path import dirname, abspath
+sys.path.append(dirname(dirname(abspath(__file__))))
+
+from cv2utils import scalingTemplate
+from pokeocr import pokeocr
+from poketimer import poketimer
+
+# Scans lots of invites at once, e.g. to see how a config change does against
+# an archive of screenshots.  Each worker process builds its pokeocr once and
+# the templates are prepared once, before the workers are started.  Results
+# are written as they come in, one JSON object per line, in whatever order
+# the images finish.  Comparing the output of two runs shows what a change
+# fixed or broke.
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+# Set in the parent before the pool starts, so every worker shares them
+templates = None
+# Set in each worker by initWorker
+ocr = None
+useCity = True
+
+# Expands the arguments into image paths.  Directories are searched for
+# images, and any other file that isn't an image is a manifest listing one
+# image path per line, relative to the manifest.
+def findImages(paths):
+  for path in paths:
+    if os.path.isdir(path):
+      for (root, dirs, files) in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+          if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+            yield os.path.join(root, name)
+    elif os.path.splitext(path)[1].lower() in IMAGE_EXTENSIONS:
+      yield path
+    else:
+      with open(path) as fp:
+        for line in fp:
+          line = line.strip()
+          if line and not line.startswith('#'):
+            yield os.path.join(dirname(path), line)
+
+def initWorker(configfile, layout, xheight):
+  global ocr, useCity
+  with open(configfile) as f:
+    config = json.load(f)
+  ocr = pokeocr(config['location_regular_expression'], config_file=configfile)
+  if layout:
+    ocr.ocr_layout = layout
+  if xheight is not None:
+    ocr.ocr_x_height = xheight
+  useCity = config.get('include_city_in_channel_names', True)
+
+# With a sink, pokeocr also notes how well the templates matched
+def keepTimings(timer):
+  pass
+
+def scan(path):
+  timer = poketimer(keepTimings)
+  result = {'image': path}
+  try:
+    with timer.stage('read'):
+      image = cv2.imread(path)
+    if image is None:
+      raise IOError('Could not read image')
+    raidInfo = ocr.scanExRaidImage(image, templates[0], templates[1], useCity, timer=timer)
+    result['result'] = raidInfo.toDict()
+    # These are already in the output
+    result['result'].pop('timings', None)
+    result['result'].pop('confidence', None)
+  except Exception, e:
+    result['error'] = type(e).__name__
+    result['message'] = str(e)
+  result['timings'] = dict(timer.stages, total=timer.elapsed())
+  result.update(timer.info)
+  return result
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Scan many EX raid images, writing the results as JSON lines')
+  parser.add_argument('-f', dest='configfile', default='config/exraid.json')
+  parser.add_argument('-j', dest='workers', type=int, default=multiprocessing.cpu_count())
+  parser.add_argument('-o', dest='output', help='write the results here instead of to stdout')
+  parser.add_argument('-l', dest='layout', help='override ocr_layout')
+  parser.add_argument('-x', dest='xheight', type=int, help='override ocr_x_height')
+  parser.add_argument('paths', nargs='+', help='images, directories of images, or files listing images')
+  args = parser.parse_args()
+
+  with open(args.configfile) as f:
+    config = json.load(f)
+  templates = (scalingTemplate.fromFile(config['top_left_image']),
+               scalingTemplate.fromFile(config['bottom_image']))
+
+  if args.output:
+    out = open(args.output, 'w')
+  else:
+    out = sys.stdout
+
+  start = time.time()
+  count = 0
+  errors = 0
+  initargs = (args.configfile, args.layout, args.xheight)
+  if args.workers > 1:
+    pool = multiprocessing.Pool(args.workers, initWorker, initargs)
+    results = pool.imap_unordered(scan, findImages(args.paths), 4)
+  else:
+    initWorker(*initargs)
+    results = (scan(path) for path in findImages(args.paths))
+
+  try:
+    for result in results:
+      count += 1
+      if 'error' in result:
+        errors += 1
+      out.write(json.dumps(result, sort_keys=True) + '\n')
+      out.flush()
+  except KeyboardInterrupt:
+    traceback.print_exc()
+
+  elapsed = time.time() - start
+  sys.stderr.write('%d images, %d errors in %.1fs (%.2f images/s)\n' % (count, errors, elapsed, count / elapsed if elapsed else 0))
+  if errors:
+    sys.exit(1)
@@ -0,0 +1,245 @@
+#!/usr/bin/python
+import cv2
+import sys
+import json
+import argparse
+import collections
+import glob
+import os
+import resource
+import time
+
+from os.path import dirname, abspath
+sys.path.append(dirname(dirname(abspath(__file__))))
+sys.path.append(os.path.join(dirname(dirname(abspath(__file__))), 'tests'))
+
+from cv2utils import scalingTemplate, scaleCache, preprocessContext
+from pokeocr import pokeocr
+from test_raidinfo_validation import VALIDATION_IMAGES_AND_DATA
+
+# Times each stage of reading an invite across all of test_images, and the
+# whole thing end to end.  "new MB" is how much memory each call touched for
+# the first time, i.e. allocated; run with --fresh-buffers to see how much
+# reusing preprocessing buffers saves.  With --save, the results become the baseline;
+# otherwise they're compared against it and the script exits with an error if
+# any stage's median got more than --tolerance times slower.
+#
+# Baselines depend on the machine, so save one before making changes and
+# compare against it on the same machine.
+#
+# With -x, it instead compares OCR speed and accuracy (against the expected
+# results in tests/test_raidinfo_validation.py) for several ocr_x_height
+# settings.
+
+def percentile(values, p):
+  values = sorted(values)
+  return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+# Peak resident memory of the process so far, in MB.  It never goes down, so
+# the value after each stage is the high-water mark up to and including it.
+def peakMemory():
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+# Minor page faults so far.  Each one is a page of memory touched for the
+# first time, so the faults per call show how much new memory a stage
+# allocates, even when it's freed again straight away.
+def pageFaults():
+  return resource.getrusage(resource.RUSAGE_SELF).ru_minflt
+
+def summarize(times, failures, error, faults):
+  return collections.OrderedDict([
+    ('count', len(times)),
+    ('failures', failures),
+    ('first_error', error),
+    ('mean', sum(times) / len(times) if times else 0),
+    ('p50', percentile(times, 50) if times else 0),
+    ('p90', percentile(times, 90) if times else 0),
+    ('p99', percentile(times, 99) if times else 0),
+    ('per_second', len(times) / sum(times) if sum(times) else 0),
+    ('peak_mb', peakMemory()),
+    ('new_mb', faults * resource.getpagesize() / 1048576.0 / len(times) if times else 0),
+  ])
+
+# Calls func(item) `repeat` times for each item, and returns the results of
+# the last round (None where it failed) and the summary
+def timeStage(func, items, repeat):
+  times = []
+  failures = 0
+  error = None
+  results = []
+  faults = pageFaults()
+  for item in items:
+    result = None
+    for i in range(repeat):
+      start = time.time()
+      try:
+        result = func(item)
+      except Exception, e:
+        result = None
+        failures += 1
+        error = error or '%s: %s' % (type(e).__name__, e)
+      times.append(time.time() - start)
+    results.append(result)
+  return (results, summarize(times, failures, error, pageFaults() - faults))
+
+def run(ocr, images, topleft, bottom, repeat, useCity):
+  stats = collections.OrderedDict()
+
+  # Without the scale cache, so every crop runs the full template match
+  def crop(image):
+    ocr.scale_cache = scaleCache()
+    return ocr.cropExRaidImage(image, topleft, bottom)
+  (crops, stats['crop']) = timeStage(crop, images, repeat)
+
+  # With the scale cache warmed up by the first image, as in production
+  ocr.scale_cache = scaleCache()
+  (crops, stats['crop_cached']) = timeStage(lambda image: ocr.cropExRaidImage(image, topleft, bottom), images, repeat)
+
+  crops = [c for c in crops if c is not None]
+  (pils, stats['preprocess']) = timeStage(ocr.preprocess, crops, repeat)
+  (texts, stats['ocr']) = timeStage(ocr.getEngine().image_to_string, [p for p in pils if p is not None], repeat)
+  (_, stats['parse']) = timeStage(lambda txt: ocr.parseText(txt, useCity), [t for t in texts if t is not None], repeat)
+
+  def endToEnd(image):
+    ocr.scale_cache = scaleCache()
+    return ocr.scanExRaidImage(image, topleft, bottom, useCity)
+  (_, stats['end_to_end']) = timeStage(endToEnd, images, repeat)
+
+  return stats
+
+# Whether a scan result matches what's expected for an image, or None if
+# nothing's expected for it
+def isCorrect(raidInfo, expected):
+  if expected is None:
+    return None
+  return raidInfo is not None and all([getattr(raidInfo, k, None) == v for k, v in expected.iteritems()])
+
+# Times preprocessing and OCR with each ocr_x_height setting (0 being the
+# fixed scale), and counts how many images come out right
+def sweep(ocr, names, images, expected, topleft, bottom, settings, repeat, useCity):
+  crops = []
+  for image in images:
+    try:
+      crops.append(ocr.cropExRaidImage(image, topleft, bottom))
+    except Exception:
+      crops.append(None)
+
+  print('%-9s %12s %9s %9s %9s %8s' % ('x-height', 'megapixels', 'prep ms', 'ocr ms', 'total ms', 'correct'))
+  for setting in settings:
+    ocr.ocr_x_height = setting
+    pixels = []
+    timings = collections.defaultdict(list)
+    correct = 0
+    checked = 0
+    for name, crop in zip(names, crops):
+      if crop is None:
+        continue
+      for i in range(repeat):
+        start = time.time()
+        pil = ocr.preprocess(crop)
+        prepared = time.time()
+        txt = ocr.getEngine().image_to_string(pil)
+        read = time.time()
+        try:
+          raidInfo = ocr.parseText(txt, useCity)
+        except Exception:
+          raidInfo = None
+        timings['preprocess'].append(prepared - start)
+        timings['ocr'].append(read - prepared)
+        timings['total'].append(time.time() - start)
+      pixels.append(pil.size[0] * pil.size[1] / 1000000.0)
+      result = isCorrect(raidInfo, expected.get(name))
+      if result is not None:
+        checked += 1
+        correct += result
+    print('%-9s %12.2f %9.1f %9.1f %9.1f %8s' % (setting or 'fixed', sum(pixels) / max(1, len(pixels)),
+      percentile(timings['preprocess'], 50) * 1000, percentile(timings['ocr'], 50) * 1000,
+      percentile(timings['total'], 50) * 1000, '%d/%d' % (correct, checked)))
+
+# Returns a description of each stage that's slower than the baseline allows
+def regressions(stats, baseline, tolerance):
+  slower = []
+  for stage, summary in stats.iteritems():
+    if stage not in baseline or not baseline[stage]['p50']:
+      continue
+    ratio = summary['p50'] / baseline[stage]['p50']
+    if ratio > tolerance:
+      slower.append('%s: median %.1fms, was %.1fms (%.2fx)' % (stage, summary['p50'] * 1000, baseline[stage]['p50'] * 1000, ratio))
+  return slower
+
+def report(stats, baseline):
+  print('%-12s %6s %5s %9s %9s %9s %9s %8s %8s %8s %10s' % ('stage', 'count', 'fail', 'mean ms', 'p50 ms', 'p90 ms', 'p99 ms', 'per sec', 'peak MB', 'new MB', 'vs base'))
+  for stage, s in stats.iteritems():
+    if stage in baseline and baseline[stage]['p50']:
+      change = '%.2fx' % (s['p50'] / baseline[stage]['p50'])
+    else:
+      change = '-'
+    print('%-12s %6d %5d %9.1f %9.1f %9.1f %9.1f %8.1f %8.1f %8.1f %10s' % (stage, s['count'], s['failures'], s['mean'] * 1000, s['p50'] * 1000, s['p90'] * 1000, s['p99'] * 1000, s['per_second'], s['peak_mb'], s.get('new_mb', 0), change))
+  for stage, s in stats.iteritems():
+    if s['first_error']:
+      print('%s failed %d times, first with %s' % (stage, s['failures'], s['first_error']))
+
+if __name__ == '__main__':
+  root = dirname(dirname(abspath(__file__)))
+  parser = argparse.ArgumentParser(description='Benchmark reading EX raid invites')
+  parser.add_argument('-f', dest='configfile', default='config/exraid.json')
+  parser.add_argument('-d', dest='imagedir', default=os.path.join(root, 'test_images'))
+  parser.add_argument('-n', dest='repeat', type=int, default=3, help='times to run each stage on each image')
+  parser.add_argument('-b', dest='baseline', default=os.path.join(root, 'debug', 'benchmark.baseline.json'))
+  parser.add_argument('-t', dest='tolerance', type=float, default=1.25, help='how much slower a stage may get before it fails')
+  parser.add_argument('-l', dest='layout', help='override ocr_layout')
+  parser.add_argument('-x', dest='xheights', help='compare these ocr_x_height settings, e.g. 0,16,20,24')
+  parser.add_argument('--fresh-buffers', action='store_true', help='use new preprocessing buffers for every image, to compare with reusing them')
+  parser.add_argument('--save', action='store_true', help='save the results as the new baseline')
+  parser.add_argument('--json', action='store_true', help='print the results as JSON')
+  args = parser.parse_args()
+
+  with open(args.configfile) as f:
+    config = json.load(f)
+
+  topleft = scalingTemplate.fromFile(config['top_left_image'])
+  bottom = scalingTemplate.fromFile(config['bottom_image'])
+  files = sorted([f for f in glob.glob(os.path.join(args.imagedir, '*', '*', '*'))
+                  if os.path.splitext(f)[1].lower() in ('.png', '.jpg', '.jpeg')])
+  images = [cv2.imread(f) for f in files]
+  if not images:
+    print('No images found in ' + args.imagedir)
+    sys.exit(2)
+
+  ocr = pokeocr(config['location_regular_expression'], config_file=args.configfile)
+  if args.layout:
+    ocr.ocr_layout = args.layout
+  if args.fresh_buffers:
+    ocr.context = lambda: preprocessContext()
+  useCity = config.get('include_city_in_channel_names', True)
+  if args.xheights:
+    names = [os.path.relpath(f, args.imagedir) for f in files]
+    expected = dict([(a['image'], a['expected']) for a in VALIDATION_IMAGES_AND_DATA])
+    sweep(ocr, names, images, expected, topleft, bottom, [int(x) for x in args.xheights.split(',')], args.repeat, useCity)
+    sys.exit(0)
+
+  stats = run(ocr, images, topleft, bottom, args.repeat, useCity)
+
+  baseline = {}
+  if os.path.exists(args.baseline) and not args.save:
+    with open(args.baseline) as f:
+      baseline = json.load(f)
+
+  if args.json:
+    print(json.dumps(stats, indent=2))
+  else:
+    print('%d images, %d runs each' % (len(images), args.repeat))
+    report(stats, baseline)
+
+  if args.save:
+    with open(args.baseline, 'w') as f:
+      json.dump(stats, f, indent=2)
+    print('Saved baseline to ' + args.baseline)
+  else:
+    slower = regressions(stats, baseline, args.tolerance)
+    if slower:
+      print('')
+      print('\033[31mSlower than the baseline:\033[0m')
+      for line in slower:
+        print('  ' + line)
+      sys.exit(1)
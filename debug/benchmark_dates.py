@@ -0,0 +1,46 @@
+#!/usr/bin/python
+import sys
+import argparse
+import time
+import timeit
+
+from os.path import dirname, abspath
+sys.path.append(dirname(dirname(abspath(__file__))))
+
+import pokeocr
+
+# Compares the built-in date/time line parser with the dateparser fallback it
+# replaced, on the kinds of lines OCR gives us
+LINES = [
+  'September 2 11:00AM - 11:45AM',
+  'September 2 11:00 AM - 11:45 AM',
+  '9 September 17:00 - 17:45',
+  'September S 1:00 PM - 1:4S PM',
+  'September 2 1Z:00 PM - 12:45 PM',
+  'June 5 5:00 PM - 5:45 PM',
+]
+
+def perLine(func, repeat):
+  # Best of 3, in microseconds per line
+  total = min(timeit.repeat(lambda: [func(line) for line in LINES], number=repeat, repeat=3))
+  return total / (repeat * len(LINES)) * 1000000
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Benchmark parsing the date/time line')
+  parser.add_argument('-n', dest='repeat', type=int, default=200)
+  args = parser.parse_args()
+
+  fast = perLine(pokeocr.parse_datetime_line, args.repeat)
+  print('parse_datetime_line:                 %10.1f us/line' % fast)
+
+  start = time.time()
+  try:
+    import dateparser
+  except ImportError:
+    print('dateparser is not installed, nothing to compare with')
+    sys.exit(0)
+  print('importing dateparser:                %10.1f ms' % ((time.time() - start) * 1000))
+
+  slow = perLine(pokeocr.parse_datetime_line_with_dateparser, max(1, args.repeat // 20))
+  print('parse_datetime_line_with_dateparser: %10.1f us/line' % slow)
+  print('speedup: %.0fx' % (slow / fast))
@@ -24,7 +24,7 @@ topleft = cv2.imread(config['top_left_image'])
 bottom = cv2.imread(config['bottom_image'])
 image = cv2.imread(args.image)
 
-ocr = pokeocr(config['location_regular_expression'])
+ocr = pokeocr(config['location_regular_expression'], config_file=args.configfile)
 
 image = ocr.cropExRaidImage(image, topleft, bottom, True)
 
@@ -26,10 +26,10 @@ topleft = cv2.imread(config['top_left_image'])
 bottom = cv2.imread(config['bottom_image'])
 image = cv2.imread(args.image)
 
+ocr = pokeocr(config['location_regular_expression'], config_file=args.configfile)
 if args.language:
   os.environ['TESSDATA_PREFIX'] = '.'
-  ocr = pokeocr(config['location_regular_expression'], args.language)
-else:
-  ocr = pokeocr(config['location_regular_expression'])
+  # The engine is set up on first use, so this still takes effect
+  ocr.preferred_language = args.language
 
 print ocr.scanExRaidImage(image, topleft, bottom, debug=True)
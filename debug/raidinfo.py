@@ -27,7 +27,7 @@ topleft = cv2.imread(config['top_left_image'])
 bottom = cv2.imread(config['bottom_image'])
 image = cv2.imread(args.image)
 
-ocr = pokeocr(config['location_regular_expression'])
+ocr = pokeocr(config['location_regular_expression'], config_file=args.configfile)
 
 raidInfo = ocr.scanExRaidImage(image, topleft, bottom)
 
@@ -35,8 +35,8 @@ raidInfo = ocr.scanExRaidImage(image, topleft, bottom)
 print('')
 print('\033[1;35m *** Results *** \033[0m')
 print('\033[35m=================\033[0m')
-for key, value in raidInfo.__dict__.iteritems():
-  print_kv_line(key, value)
+for key in ('month', 'day', 'begin', 'end', 'location', 'city'):
+  print_kv_line(key, getattr(raidInfo, key, None))
 
 print_kv_line('category', pokediscord.generateCategoryName(raidInfo))
 print_kv_line('channel', pokediscord.generateChannelName(raidInfo))
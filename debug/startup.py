@@ -0,0 +1,79 @@
+#!/usr/bin/python
+import sys
+import json
+import argparse
+import collections
+import subprocess
+import time
+import traceback
+
+from os.path import dirname, abspath
+ROOT = dirname(dirname(abspath(__file__)))
+sys.path.append(ROOT)
+
+# Times what the bot does before it can connect to the gateway (importing the
+# plugin, each time in a fresh process so nothing is already loaded), and the
+# OCR setup that now happens in the background once it's connected.  Before
+# that setup moved out of the plugin's load, all of it came before
+# connecting.
+
+IMPORT_SCRIPT = '''
+import sys, time
+sys.path.insert(0, %r)
+start = time.time()
+import plugins.exraidplugin
+print time.time() - start
+'''
+
+def timeImport(runs):
+  times = []
+  for i in range(runs):
+    output = subprocess.check_output([sys.executable, '-W', 'ignore', '-c', IMPORT_SCRIPT % ROOT])
+    times.append(float(output.split()[-1]))
+  return sorted(times)[len(times) // 2]
+
+def timeStep(results, name, func, *args, **kwargs):
+  start = time.time()
+  try:
+    value = func(*args, **kwargs)
+  except Exception, e:
+    traceback.print_exc()
+    results[name] = 'failed: %s' % type(e).__name__
+    return None
+  results[name] = time.time() - start
+  return value
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Time the bot\'s startup')
+  parser.add_argument('-f', dest='configfile', default='config/exraid.json')
+  parser.add_argument('-n', dest='runs', type=int, default=5, help='fresh processes to time the import in')
+  parser.add_argument('--json', action='store_true', help='print the results as JSON')
+  args = parser.parse_args()
+
+  with open(args.configfile) as f:
+    config = json.load(f)
+
+  results = collections.OrderedDict()
+  results['import_plugin'] = timeImport(args.runs)
+
+  # The same steps as the plugin's loadOcr
+  from cv2utils import scalingTemplate
+  from pokeocr import pokeocr
+  timeStep(results, 'templates', lambda: (scalingTemplate.fromFile(config['top_left_image']),
+                                          scalingTemplate.fromFile(config['bottom_image'])))
+  ocr = timeStep(results, 'pokeocr', pokeocr, config['location_regular_expression'], config_file=args.configfile)
+  if ocr is not None:
+    timeStep(results, 'ocr_engine', ocr.warmup)
+
+  if args.json:
+    print json.dumps(results, indent=2)
+  else:
+    for (name, value) in results.iteritems():
+      if name == 'import_plugin':
+        print 'Before connecting:'
+      elif name == 'templates':
+        print 'After connecting, in the background:'
+      if isinstance(value, float):
+        print '  %-14s %8.1fms' % (name, value * 1000)
+      else:
+        print '  %-14s %s' % (name, value)
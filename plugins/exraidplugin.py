@@ -3,17 +3,24 @@ from disco.bot import Bot, Plugin, Config
 from disco.types.permissions import PermissionValue, Permissions
 from disco.types.channel import PermissionOverwriteType, PermissionOverwrite
 
-import cv2
 import datetime
+import gevent
 import re
 import dateutil.parser
 import traceback
 import os
-from fuzzywuzzy import fuzz
 
 import pokeocr
 from pokediscord import pokediscord
-from cv2utils import cv2utils
+from pokepipeline import pokepipeline
+from pokecache import pokecache
+from pokeindex import pokeindex
+from pokepurger import pokepurger
+from pokeroster import pokeroster
+from pokestate import pokestate
+from pokerest import pokerest
+from poketimer import poketimer, createTimingSink
+from cv2utils import cv2utils, scalingTemplate, imageDownloader, ImageTooLargeException
 
 class ExRaidPluginConfig(Config):
   def loadDefaults(self, config):
@@ -37,55 +44,85 @@ class ExRaidPlugin(Plugin):
   def load(self, ctx):
     super(ExRaidPlugin, self).load(ctx)
     self.config.loadDefaults(self.bot.config)
-    self.topleft = cv2.imread(self.config.top_left_image)
-    self.bottom = cv2.imread(self.config.bottom_image)
-    self.ocr = pokeocr.pokeocr(self.config.location_regular_expression)
+    # Route all REST requests through the budgeter
+    self.rest = pokerest(self.client.api.http, getattr(self.config, 'rest_concurrency', 4))
+    self.client.api.http = self.rest
+    self.rest.start(getattr(self.config, 'rest_metrics_file', None))
+    # The templates and OCR are set up by warmup
+    self.warming = None
     self.exChannelRE = re.compile('^([0-9]{1,2})-([0-9]{1,2})_ex_')
+    self.pipeline = pokepipeline(getattr(self.config, 'processing_workers', 2))
+    self.downloader = imageDownloader(getattr(self.config, 'max_image_bytes', 10 * 1024 * 1024))
+    self.results = pokecache(getattr(self.config, 'result_cache_size', 1000), getattr(self.config, 'result_cache_file', None))
+    self.index = pokeindex()
+    self.purger = pokepurger(self.config.old_channel_grace_days)
+    self.purger.start()
+    stateFile = getattr(self.config, 'state_file', None)
+    self.state = pokestate(stateFile)
+    # With a state file, roster message ids are kept there instead
+    self.roster = pokeroster(self.config.messages['users_in_channel_message'], getattr(self.config, 'roster_file', None),
+                             state=self.state if stateFile else None)
+    self.timings = createTimingSink(getattr(self.config, 'timing_sink', None), getattr(self.config, 'timing_file', None))
+
+  def unload(self, ctx):
+    self.purger.stop()
+    self.rest.stop()
+    self.state.close()
+    self.client.api.http = self.rest.http
+    super(ExRaidPlugin, self).unload(ctx)
+
+  # Preparing the match templates and finding tesseract are slow, and doing
+  # them in load would hold up connecting to the gateway.  They're done in
+  # the background once we're connected instead, and scans wait for them.
+  @Plugin.listen('Ready')
+  def on_ready(self, event):
+    self.startWarmup()
+
+  def startWarmup(self):
+    if self.warming is None:
+      self.warming = gevent.spawn(self.loadOcr)
+    return self.warming
+
+  # Runs in a greenlet rather than on the worker pool, as finding tesseract
+  # starts processes, which only the main thread can do
+  def loadOcr(self):
+    (topleft, bottom) = self.pipeline.scan(self.loadTemplates)
+    ocr = pokeocr.pokeocr(self.config.location_regular_expression)
+    ocr.warmup()
+    (self.topleft, self.bottom, self.ocr) = (topleft, bottom, ocr)
+
+  def loadTemplates(self):
+    return (scalingTemplate.fromFile(self.config.top_left_image),
+            scalingTemplate.fromFile(self.config.bottom_image))
+
+  # Returns once loadOcr has run.  If it failed, it's tried again on the
+  # next call.
+  def warmup(self):
+    try:
+      self.startWarmup().get()
+    except Exception:
+      self.warming = None
+      raise
+
+  def getChannelByName(self, cname, guild):
+    return self.index.forGuild(guild).channelByName(cname)
+
+  # Returns the existing channel whose name is close enough to cname that
+  # it's probably the same raid with an OCR mistake, or None
+  def getChannelByNameFuzzy(self, cname, guild):
+    threshold = getattr(self.config, 'fuzzy_channel_match_threshold', 100)
+    if threshold >= 100 or self.getChannelByName(cname, guild):
+      return None
+    found = self.index.forGuild(guild).channelByNameFuzzy(cname, threshold)
+    if found is None:
+      return None
+    return found[0]
 
-  @staticmethod
-  def getChannelByName(cname, channels):
-    for channel in channels.values():
-      if channel.name == cname:
-        return channel
-    return None
+  def getEveryoneRole(self, guild):
+    return self.getRoleByName('@everyone', guild)
 
-  # Returns the closest matching channel name
-  @staticmethod
-  def getChannelByNameFuzzy(cname, channels):
-    has_ts_re = re.compile('_([0-9]{4})$')
-
-    match = has_ts_re.search(cname)
-    if match:
-      ts = match.group(1)
-    else:
-      ts = 0
-
-    best = None
-    bscore = None
-    for channel in channels.values():
-      score = fuzz.ratio(channel.name, cname)
-      match = has_ts_re.search(channel.name)
-      if match:
-        thists = match.group(1)
-      else:
-        thists = 0
-
-      if (bscore is None or score > bscore) and ts == thists:
-        best = channel
-        bscore = score
-
-    return (best, bscore)
-
-  @classmethod
-  def getEveryoneRole(cls, guild):
-    return cls.getRoleByName('@everyone', guild)
-
-  @staticmethod
-  def getRoleByName(name, guild):
-    for id, role in guild.roles.iteritems():
-      if role.name == name:
-        return role
-    return None
+  def getRoleByName(self, name, guild):
+    return self.index.forGuild(guild).roleByName(name)
 
   @staticmethod
   def dateDiff(datestring):
@@ -93,36 +130,15 @@ class ExRaidPlugin(Plugin):
     now = datetime.datetime.today()
     return begin - now
 
-  def purgeOldChannels(self, channels):
-    if self.config.old_channel_grace_days == -1:
-      return None
-    for channel in channels.values():
-      date = pokediscord.channelNameToDate(channel.name)
-      if not date:
-        continue
-      if self.dateDiff(date).days < -self.config.old_channel_grace_days:
-        channel.delete()
-
-  @staticmethod
-  def alphabetizeChannels(category, channels):
+  def alphabetizeChannels(self, category, guild):
     subchannels = {}
-    for channel in channels.values():
-      if channel.parent is None:
-        continue
-      if channel.parent.name == category.name:
-        subchannels[channel.name] = channel
-
-    pos = 0
-    for name, channel in sorted(subchannels.iteritems()):
-      channel.set_position(pos)
-      pos += 1
+    for channel in self.index.forGuild(guild).children(category.id):
+      subchannels[channel.name] = channel
 
-  @staticmethod
-  def userInChannel(user, channel):
-    for snowflake, overwrite in channel.overwrites.iteritems():
-      if overwrite.type == PermissionOverwriteType.MEMBER and overwrite.id == user.id:
-        return True
-    return False
+    # Only the channels that are out of place get moved, all in one request
+    channels = [channel for name, channel in sorted(subchannels.iteritems())]
+    with pokerest.housekeeping():
+      pokediscord.reorderChannels(self.client, guild.id, channels)
 
   @staticmethod
   def atReply(message, text, author=None):
@@ -130,6 +146,59 @@ class ExRaidPlugin(Plugin):
       author=message.author
     message.reply('<@' + str(author.id) + '> ' + text)
 
+  # Keep the channel and role indexes and the purge schedule current
+
+  @Plugin.listen('GuildCreate')
+  def on_guild_create(self, event):
+    for channel in self.index.guildLoaded(event.guild).channels():
+      self.purger.track(event.guild, channel)
+    self.state.guildLoaded(event.guild)
+
+  @Plugin.listen('ChannelCreate')
+  def on_channel_create(self, event):
+    self.channelChanged(event.channel)
+
+  @Plugin.listen('ChannelUpdate')
+  def on_channel_update(self, event):
+    self.channelChanged(event.channel)
+
+  @Plugin.listen('ChannelDelete')
+  def on_channel_delete(self, event):
+    self.index.channelDeleted(event.channel)
+    self.state.channelDeleted(event.channel.id)
+    self.purger.untrack(event.channel.id)
+    self.roster.forget(event.channel.id)
+
+  def channelChanged(self, channel):
+    self.index.channelChanged(channel)
+    self.state.channelChanged(channel)
+    if channel.guild is not None:
+      self.purger.track(channel.guild, channel)
+
+  # For channels we create.  disco doesn't add them to the guild until the
+  # gateway's ChannelCreate arrives, and the next invite for the same raid
+  # may well be handled before that.
+  def channelCreated(self, guild, channel):
+    self.index.channelCreated(guild, channel)
+    self.state.channelChanged(channel)
+    self.purger.track(guild, channel)
+
+  @Plugin.listen('GuildRoleCreate')
+  def on_guild_role_create(self, event):
+    self.index.roleChanged(event.guild_id, event.role)
+
+  @Plugin.listen('GuildRoleUpdate')
+  def on_guild_role_update(self, event):
+    self.index.roleChanged(event.guild_id, event.role)
+
+  @Plugin.listen('GuildRoleDelete')
+  def on_guild_role_delete(self, event):
+    self.index.roleDeleted(event.guild_id, event.role_id)
+
+  @Plugin.listen('GuildDelete')
+  def on_guild_delete(self, event):
+    self.index.guildDeleted(event.id)
+
   @Plugin.listen('MessageReactionAdd')
   def on_reaction_add(self, event):
     if not '#' + event.channel.name in self.config.channels_to_watch:
@@ -151,33 +220,43 @@ class ExRaidPlugin(Plugin):
       self.atReply(message, self.config.messages['not_allowed_to_reprocess'], user)
       return None
 
-    self.process_message(event, message)
+    self.pipeline.submit(self.process_message, event, message)
 
   @Plugin.listen('MessageCreate')
   def on_message_create(self, event):
     if not '#' + event.channel.name in self.config.channels_to_watch:
       return None
-    self.process_message(event)
+    self.pipeline.submit(self.process_message, event)
 
   def process_message(self, event, message=None):
     if message is None:
       message = event.message
     for key, value in message.attachments.iteritems():
+      timer = poketimer(self.timings)
+      timer.note(message=message.id, attachment=key)
       # Get the info from the image
       try:
-        image = cv2utils.urlToImage(value.url)
-        raidInfo = self.ocr.scanExRaidImage(image, self.topleft, self.bottom, useCity=self.config.include_city_in_channel_names)
+        raidInfo = self.scanAttachment(value.url, timer)
         try:
           if raidInfo.city not in self.config.allowed_cities and len(self.config.allowed_cities) > 0:
             self.atReply(message, self.config.messages['city_not_allowed'] + ', '.join(self.config.allowed_cities))
+            timer.emit(result='city_not_allowed')
             continue
         except AttributeError:
           # We'll assume no city is okay
           pass
         if self.dateDiff(raidInfo.month + '-' + raidInfo.day + ' ' + raidInfo.begin).days < 0:
           self.atReply(message, self.config.messages['date_in_past'])
+          timer.emit(result='date_in_past')
           continue
         cname = pokediscord.generateChannelName(raidInfo, self.config.include_city_in_channel_names)
+        # Join a near-duplicate channel rather than making another one
+        channel = self.getChannelByNameFuzzy(cname, event.guild)
+        if channel is not None:
+          if 'fuzzy_channel' in self.config.messages:
+            self.atReply(message, self.config.messages['fuzzy_channel'].format(cname, channel.name))
+          timer.note(fuzzy=cname)
+          cname = channel.name
         try:
           catname = self.config.channel_category
         except AttributeError:
@@ -185,76 +264,144 @@ class ExRaidPlugin(Plugin):
       except pokeocr.MatchNotCenteredException:
         traceback.print_exc()
         self.atReply(message, self.config.messages['match_not_centered'])
+        timer.emit(result='match_not_centered')
         continue
       except pokeocr.TooFewLinesException:
         traceback.print_exc()
         self.atReply(message, self.config.messages['too_few_lines'])
+        timer.emit(result='too_few_lines')
         continue
       except pokeocr.InvalidCityException:
         traceback.print_exc()
         self.atReply(message, self.config.messages['invalid_city'])
+        timer.emit(result='invalid_city')
+        continue
+      except ImageTooLargeException:
+        traceback.print_exc()
+        self.atReply(message, self.config.messages.get('image_too_large', self.config.messages['could_not_parse']))
+        timer.emit(result='image_too_large')
         continue
       except Exception:
         traceback.print_exc()
         self.atReply(message, self.config.messages['could_not_parse'])
+        timer.emit(result='could_not_parse')
         continue
 
-      # Create the category if it doesn't exist
-      category = self.getChannelByName(catname, event.guild.channels)
+      # Channel changes for the same raid run one at a time, in order, so
+      # simultaneous invites for a new raid don't each create a channel
+      timer.note(channel=cname)
+      self.pipeline.mutate(cname, self.joinRaidChannel, event, message, catname, cname, raidInfo, timer)
+
+  # Returns the raid info for an attachment.  The download, CV and OCR run on
+  # the worker pool so other events are handled in the meantime, and OCR is
+  # skipped entirely if we've already read the same screenshot.
+  def scanAttachment(self, url, timer=None):
+    timer = timer or poketimer()
+    with timer.stage('download'):
+      buf = self.pipeline.scan(self.downloader.fetchBytes, url)
+    key = pokecache.contentKey(buf)
+    raidInfo = self.results.get(key)
+    if raidInfo is not None:
+      timer.note(cached='content')
+      return raidInfo
+
+    self.warmup()
+    with timer.stage('crop'):
+      image = self.pipeline.scan(self.cropAttachment, buf, timer)
+    with timer.stage('scan'):
+      raidInfo = self.scanCroppedImage(image, timer)
+    # The scan worked, so don't let caching it fail the invite
+    try:
+      self.results.put(raidInfo, key)
+    except Exception:
+      traceback.print_exc()
+    return raidInfo
+
+  # Preprocessing is pure cv2, so it runs on the worker pool.  The OCR only
+  # goes there if the engine can run in native threads; pyocr's tesseract
+  # processes have to be started from here, on the main thread.
+  def scanCroppedImage(self, image, timer):
+    useCity = self.config.include_city_in_channel_names
+    prepared = self.pipeline.scan(self.ocr.prepareCroppedImage, image, timer)
+    if self.ocr.getEngine().threaded:
+      return self.pipeline.scan(self.ocr.readPreparedImage, prepared, useCity, timer=timer)
+    return self.ocr.readPreparedImage(prepared, useCity, timer=timer)
+
+  def cropAttachment(self, buf, timer=None):
+    timer = timer or poketimer()
+    with timer.stage('decode'):
+      image = cv2utils.bytesToImage(buf)
+    return self.ocr.cropExRaidImage(image, self.topleft, self.bottom, timer=timer)
+
+  # Times the Discord half of handling an invite, then reports the timings
+  # for the whole thing
+  def joinRaidChannel(self, event, message, catname, cname, raidInfo, timer=None):
+    timer = timer or poketimer()
+    try:
+      with timer.stage('discord'):
+        self.addToRaidChannel(event, message, catname, cname, raidInfo)
+    finally:
+      timer.emit(result='scanned')
+
+  def addToRaidChannel(self, event, message, catname, cname, raidInfo):
+    # Create the category if it doesn't exist.  Several raid channels can
+    # share a category, so this is serialized separately.
+    with self.pipeline.lock(catname):
+      category = self.getChannelByName(catname, event.guild)
       if not category:
         category = event.guild.create_category(catname)
+        self.channelCreated(event.guild, category)
 
-      # Create the channel if it doesn't exist
-      channel = self.getChannelByName(cname, event.guild.channels)
-      if not channel:
-        try:
-          overwrites = []
-          for rname in self.config.roles_for_new_channels:
-            role = self.getRoleByName(rname, event.guild)
-            if role is None:
-              print 'Warning: role ' + rname + ' does not exist'
-              continue
-            overwrites.append(PermissionOverwrite(
-             id = role.id,
-             type = PermissionOverwriteType.ROLE,
-             allow = PermissionValue(Permissions.READ_MESSAGES)))
-
-          everyone = self.getEveryoneRole(event.guild)
+    # Create the channel if it doesn't exist
+    channel = self.getChannelByName(cname, event.guild)
+    if not channel:
+      try:
+        overwrites = []
+        for rname in self.config.roles_for_new_channels:
+          role = self.getRoleByName(rname, event.guild)
+          if role is None:
+            print 'Warning: role ' + rname + ' does not exist'
+            continue
           overwrites.append(PermissionOverwrite(
-           id = everyone.id,
+           id = role.id,
            type = PermissionOverwriteType.ROLE,
-           deny = PermissionValue(Permissions.READ_MESSAGES)))
-          channel = category.create_text_channel(cname, permission_overwrites=overwrites)
-        except Exception:
-          traceback.print_exc()
-          self.atReply(message, self.config.messages['channel_create_error'])
-          continue
+           allow = PermissionValue(Permissions.READ_MESSAGES)))
+
+        everyone = self.getEveryoneRole(event.guild)
+        overwrites.append(PermissionOverwrite(
+         id = everyone.id,
+         type = PermissionOverwriteType.ROLE,
+         deny = PermissionValue(Permissions.READ_MESSAGES)))
+        channel = category.create_text_channel(cname, permission_overwrites=overwrites)
+        self.channelCreated(event.guild, channel)
+        self.state.addRaid(channel, raidInfo)
+      except Exception:
+        traceback.print_exc()
+        self.atReply(message, self.config.messages['channel_create_error'])
+        return
 
-        # Post a sticky message to track who's in the channel
-        uic_message = channel.send_message(self.config.messages['users_in_channel_message'])
-        uic_message.pin()
+      # Post a sticky message to track who's in the channel
+      uic_message = channel.send_message(self.config.messages['users_in_channel_message'])
+      uic_message.pin()
+      self.roster.remember(channel.id, uic_message.id)
 
-        self.alphabetizeChannels(category, event.guild.channels)
+      self.alphabetizeChannels(category, event.guild)
 
-      # Is the user already in the channel?
-      if self.userInChannel(message.author, channel):
-        self.atReply(message, self.config.messages['user_already_in_channel'] + ' <#' + str(channel.id) + '>')
-        continue
-
-      # Add the user to the channel
-      try:
-        channel.create_overwrite(message.author, allow=PermissionValue(Permissions.READ_MESSAGES))
-        self.atReply(message, self.config.messages['added_success'] + ' <#' + str(channel.id) + '>')
-        channel.send_message(self.config.messages['post_add_message'] + ' <@' + str(message.author.id) + '>')
-      except Exception:
-        traceback.print_exc()
-        self.atReply(message, self.config.messages['channel_add_error'])
-        continue
+    # Is the user already in the channel?
+    if self.state.isMember(channel.id, message.author.id):
+      self.atReply(message, self.config.messages['user_already_in_channel'] + ' <#' + str(channel.id) + '>')
+      return
 
-      # Add them to the pinned message
-      for pin in channel.get_pins():
-        if pin.content.startswith(self.config.messages['users_in_channel_message']):
-          pin.edit(pin.content + ' <@' + str(message.author.id) + '>')
+    # Add the user to the channel
+    try:
+      channel.create_overwrite(message.author, allow=PermissionValue(Permissions.READ_MESSAGES))
+      self.state.addMember(channel.id, message.author.id)
+      self.atReply(message, self.config.messages['added_success'] + ' <#' + str(channel.id) + '>')
+      channel.send_message(self.config.messages['post_add_message'] + ' <@' + str(message.author.id) + '>')
+    except Exception:
+      traceback.print_exc()
+      self.atReply(message, self.config.messages['channel_add_error'])
+      return
 
-      # Purge old channels
-      self.purgeOldChannels(event.guild.channels)
+    # Add them to the pinned message
+    self.roster.add(channel, message.author.id)
@@ -0,0 +1,96 @@
+import collections
+import datetime
+import hashlib
+import json
+import os
+import time
+
+from pokeocr import exRaidData
+from pokeutil import writeAtomically
+
+# Remembers the raid info we've read from screenshots, so a screenshot that's
+# reposted, forwarded or reprocessed with a reaction doesn't go through OCR
+# again.  Results are stored under a hash of the downloaded bytes (see
+# contentKey), which catches exact copies before the image is even decoded.
+# Copies that have been re-encoded go through OCR again: no hash of the
+# image that's robust to re-encoding can also tell apart invites to the same
+# gym on different days, since only a few digits differ.
+#
+# Results are kept as exRaidData, and copies are handed out so callers can't
+# change what's cached.  The least recently used results are dropped once
+# there are more than `size` keys, and every result is dropped the day after
+# its raid.  If a filename is given, the cache is persisted there as JSON.
+class pokecache:
+  def __init__(self, size=1000, filename=None):
+    self.size = size
+    self.filename = filename
+    self.entries = collections.OrderedDict()
+    if filename and os.path.exists(filename):
+      try:
+        with open(filename, 'r') as fp:
+          for key, (expires, data) in json.load(fp):
+            self.entries[key] = (expires, exRaidData.fromDict(data))
+      except (ValueError, TypeError, AttributeError):
+        # Corrupt cache, start over
+        self.entries = collections.OrderedDict()
+      self.expire()
+
+  @staticmethod
+  def contentKey(buf):
+    return 'sha1:' + hashlib.sha1(buf).hexdigest()
+
+  # Returns the time (seconds since the epoch) after which a result is no
+  # longer useful: the end of the day after the raid
+  @staticmethod
+  def expiryFor(raidInfo, now=None):
+    if now is None:
+      now = datetime.datetime.now()
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    raid = pokecache.raidDate(today.year, raidInfo.monthNumber, raidInfo.dayNumber)
+    # Invites don't include the year, so a date that looks long past is
+    # really next year's, e.g. a January raid seen in December
+    if (today - raid).days > 180:
+      raid = pokecache.raidDate(today.year + 1, raidInfo.monthNumber, raidInfo.dayNumber)
+    expires = raid + datetime.timedelta(days=2)
+    return time.mktime(expires.timetuple())
+
+  # A day past the end of the month, e.g. a misread June 31 or February 29
+  # outside a leap year, rolls over into the next month rather than failing
+  @staticmethod
+  def raidDate(year, month, day):
+    return datetime.datetime(year, month, 1) + datetime.timedelta(days=day - 1)
+
+  def get(self, key, now=None):
+    entry = self.entries.pop(key, None)
+    if entry is None:
+      return None
+    (expires, raidInfo) = entry
+    if (now or time.time()) >= expires:
+      return None
+    # Re-insert to mark it as the most recently used
+    self.entries[key] = entry
+    return raidInfo.copy()
+
+  def put(self, raidInfo, *keys):
+    entry = (self.expiryFor(raidInfo), raidInfo.copy())
+    for key in keys:
+      self.entries.pop(key, None)
+      self.entries[key] = entry
+    while len(self.entries) > self.size:
+      self.entries.popitem(last=False)
+    self.save()
+
+  def expire(self, now=None):
+    now = now or time.time()
+    for key in [k for k, (expires, raidInfo) in self.entries.iteritems() if now >= expires]:
+      del self.entries[key]
+
+  def save(self):
+    if not self.filename:
+      return
+    # Entries are saved as a list to keep their LRU order
+    entries = [(key, (expires, raidInfo.toDict())) for key, (expires, raidInfo) in self.entries.iteritems()]
+    writeAtomically(self.filename, json.dumps(entries))
+
+  def __len__(self):
+    return len(self.entries)
@@ -1,23 +1,39 @@
 import calendar
 import datetime
 import re
+import time
+import dateutil.parser
 import pokeocr
+from disco.api.http import Routes
+
+# 5-28_ex_sf_mission_creek_park
+EX_CHANNEL_RE = re.compile('^([0-9]{1,2}-[0-9]{1,2})_ex_')
+# ex_raids_5-28
+EX_CATEGORY_RE = re.compile('^ex_raids_([0-9]{1,2}-[0-9]{1,2})')
 
 class pokediscord:
   @staticmethod
   def channelNameToDate(cname):
-    # 5-28_ex_sf_mission_creek_park
-    exChannelRE = re.compile('^([0-9]{1,2}-[0-9]{1,2})_ex_')
-    match = exChannelRE.match(cname)
+    match = EX_CHANNEL_RE.match(cname)
     if match:
       return match.group(1)
-    # ex_raids_5-28
-    exCategoryRE = re.compile('^ex_raids_([0-9]{1,2}-[0-9]{1,2})')
-    match = exCategoryRE.match(cname)
+    match = EX_CATEGORY_RE.match(cname)
     if match:
       return match.group(1)
     return None
 
+  # Returns the time (seconds since the epoch) after which a raid channel or
+  # category should be deleted, or None if it isn't one of ours
+  @staticmethod
+  def channelExpiry(cname, graceDays, now=None):
+    date = pokediscord.channelNameToDate(cname)
+    if not date:
+      return None
+    if now is None:
+      now = datetime.datetime.today()
+    begin = dateutil.parser.parse(date, default=now.replace(hour=0, minute=0, second=0, microsecond=0))
+    return time.mktime((begin + datetime.timedelta(days=graceDays)).timetuple())
+
   @staticmethod
   def generateCategoryName(raidInfo):
     date = str(list(calendar.month_name).index(raidInfo.month)) + '-' + raidInfo.day
@@ -51,3 +67,24 @@ class pokediscord:
     else:
       channel =  date + '_ex_' + location
     return channel
+
+  # Works out which channels need to move so that the given channels end up
+  # in positions 0, 1, 2... in the order given.  Returns a list of
+  # (channel, position) for just the channels that aren't already there.
+  @staticmethod
+  def channelPositionChanges(channels):
+    changes = []
+    for pos, channel in enumerate(channels):
+      if channel.position != pos:
+        changes.append((channel, pos))
+    return changes
+
+  # Puts the given channels in the order given, using a single bulk request
+  # for all of the channels that need to move.  Returns how many moved.
+  @staticmethod
+  def reorderChannels(client, guild_id, channels):
+    changes = pokediscord.channelPositionChanges(channels)
+    if changes:
+      client.api.http(Routes.GUILDS_CHANNELS_MODIFY, dict(guild=guild_id),
+        json=[{'id': channel.id, 'position': pos} for channel, pos in changes])
+    return len(changes)
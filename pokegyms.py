@@ -0,0 +1,103 @@
+import collections
+import json
+import re
+import unicodedata
+import numpy as np
+
+from fuzzywuzzy import fuzz
+
+NON_ALPHANUMERIC_RE = re.compile('[^a-z0-9]+')
+
+# A known gym, as listed in the gazetteer file
+class gymEntry:
+  def __init__(self, name, city=None, aliases=None):
+    self.name = name
+    self.city = city
+    self.aliases = aliases or []
+
+# The known gyms in the area, for snapping OCRed gym names to the real thing.
+#
+# The gazetteer file is a JSON list of {"name": ..., "city": ..., "aliases":
+# [...]}, where city and aliases are optional.  Every name and alias is
+# indexed by its trigrams, so a lookup only scores the few names that share
+# the most trigrams with what was read, however many gyms there are.  The
+# trigram counting is done by numpy, as common trigrams like " pa" can be in
+# thousands of names.
+class pokegyms:
+  def __init__(self, gyms=None, threshold=85, candidates=8):
+    self.threshold = threshold
+    self.candidates = candidates
+    self.gyms = []
+    # (normalized name, gym) for every name and alias
+    self.names = []
+    # trigram -> indexes into self.names
+    self.index = collections.defaultdict(list)
+    # self.index as numpy arrays, built on the first lookup after an add
+    self.arrays = None
+    for gym in gyms or []:
+      self.add(gym)
+
+  @classmethod
+  def fromFile(cls, filename, threshold=85):
+    with open(filename, 'r') as fp:
+      data = json.load(fp)
+    return cls([gymEntry(g['name'], g.get('city'), g.get('aliases')) for g in data], threshold)
+
+  @staticmethod
+  def normalize(name):
+    if isinstance(name, unicode):
+      name = unicodedata.normalize('NFKD', name).encode('ascii', 'ignore')
+    return NON_ALPHANUMERIC_RE.sub(' ', name.lower()).strip()
+
+  @staticmethod
+  def trigrams(normalized):
+    padded = '  ' + normalized + ' '
+    return set([padded[i:i + 3] for i in range(len(padded) - 2)])
+
+  def add(self, gym):
+    self.gyms.append(gym)
+    for name in [gym.name] + gym.aliases:
+      normalized = self.normalize(name)
+      for gram in self.trigrams(normalized):
+        self.index[gram].append(len(self.names))
+      self.names.append((normalized, gym))
+    self.arrays = None
+
+  # Returns (gym, score) for the known gym closest to an OCRed name, or None
+  # if nothing scores at least the threshold (0-100, as in fuzz.ratio).  If
+  # a city is given, gyms in other cities are only used when no gym in that
+  # city is close enough.
+  def lookup(self, name, city=None):
+    normalized = self.normalize(name)
+    if not normalized:
+      return None
+
+    if self.arrays is None:
+      self.arrays = dict((gram, np.array(indexes, np.int32)) for gram, indexes in self.index.iteritems())
+    postings = [self.arrays[gram] for gram in self.trigrams(normalized) if gram in self.arrays]
+    if not postings:
+      return None
+
+    overlap = np.bincount(np.concatenate(postings), minlength=len(self.names))
+    count = min(self.candidates, len(self.names))
+    top = np.argpartition(overlap, -count)[-count:]
+
+    best = None
+    for i in top:
+      if not overlap[i]:
+        continue
+      (candidate, gym) = self.names[i]
+      score = fuzz.ratio(normalized, candidate)
+      if score < self.threshold:
+        continue
+      # Prefer gyms in the right city, then the highest score
+      key = (city is None or gym.city is None or gym.city.lower() == city.lower(), score)
+      if best is None or key > best[0]:
+        best = (key, gym, score)
+
+    if best is None:
+      return None
+    return (best[1], best[2])
+
+  def __len__(self):
+    return len(self.gyms)
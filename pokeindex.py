@@ -0,0 +1,200 @@
+import re
+
+from fuzzywuzzy import fuzz
+
+# 5-28_ex_, the start of every raid channel name
+EX_CHANNEL_DATE_RE = re.compile('^[0-9]{1,2}-[0-9]{1,2}_ex_')
+# 5-28_ex_sf_starbucks_1330
+EX_CHANNEL_TIME_RE = re.compile('_([0-9]{4})$')
+
+# Name lookups for guild channels and roles.  Scanning every channel in a
+# guild for each lookup gets slow on big servers, so each guild gets an index
+# that's built on first use and then kept current from the gateway's channel
+# and role events.
+#
+# The index only stores ids.  Lookups resolve them through the guild's own
+# channel and role maps, so they always return disco's current objects.  The
+# exception is channels the bot has just created: disco only adds them to the
+# guild when the gateway's ChannelCreate arrives, so until then the index
+# holds on to the objects the API returned.
+#
+# Raid channels are also grouped by the date at the start of their name, so
+# a fuzzy lookup for a misread gym name only has to score the channels for
+# the same day.
+class guildIndex:
+  def __init__(self, guild):
+    self.guild = guild
+    self.channelIds = {}
+    self.channelNames = {}
+    self.childIds = {}
+    self.channelParents = {}
+    self.dateIds = {}
+    self.roleIds = {}
+    self.roleNames = {}
+    # id -> channel, for channels we created that the guild doesn't have yet
+    self.created = {}
+    for channel in guild.channels.values():
+      self.addChannel(channel)
+    for role in guild.roles.values():
+      self.addRole(role)
+
+  @staticmethod
+  def indexAdd(index, key, value):
+    index.setdefault(key, set()).add(value)
+
+  @staticmethod
+  def indexRemove(index, key, value):
+    values = index.get(key)
+    if values is None:
+      return
+    values.discard(value)
+    if not values:
+      del index[key]
+
+  @staticmethod
+  def channelDate(name):
+    match = EX_CHANNEL_DATE_RE.match(name)
+    if match:
+      return match.group(0)
+    return None
+
+  def addChannel(self, channel):
+    self.removeChannel(channel.id)
+    self.channelNames[channel.id] = channel.name
+    self.indexAdd(self.channelIds, channel.name, channel.id)
+    date = self.channelDate(channel.name)
+    if date is not None:
+      self.indexAdd(self.dateIds, date, channel.id)
+    self.channelParents[channel.id] = channel.parent_id
+    if channel.parent_id is not None:
+      self.indexAdd(self.childIds, channel.parent_id, channel.id)
+
+  def removeChannel(self, channel_id):
+    # Once the gateway tells us about a channel we created, its object is
+    # the one in the guild
+    self.created.pop(channel_id, None)
+    name = self.channelNames.pop(channel_id, None)
+    if name is not None:
+      self.indexRemove(self.channelIds, name, channel_id)
+      date = self.channelDate(name)
+      if date is not None:
+        self.indexRemove(self.dateIds, date, channel_id)
+    parent_id = self.channelParents.pop(channel_id, None)
+    if parent_id is not None:
+      self.indexRemove(self.childIds, parent_id, channel_id)
+
+  def addRole(self, role):
+    self.removeRole(role.id)
+    self.roleNames[role.id] = role.name
+    self.indexAdd(self.roleIds, role.name, role.id)
+
+  def removeRole(self, role_id):
+    name = self.roleNames.pop(role_id, None)
+    if name is not None:
+      self.indexRemove(self.roleIds, name, role_id)
+
+  def addCreatedChannel(self, channel):
+    self.addChannel(channel)
+    self.created[channel.id] = channel
+
+  def channel(self, channel_id):
+    channel = self.guild.channels.get(channel_id)
+    if channel is None:
+      channel = self.created.get(channel_id)
+    return channel
+
+  def channelByName(self, name):
+    for channel_id in self.channelIds.get(name, ()):
+      channel = self.channel(channel_id)
+      if channel is not None:
+        return channel
+    return None
+
+  # Returns (channel, score) for the raid channel on the same day whose name
+  # is closest to the given one, or None if none scores at least the
+  # threshold (0-100, as in fuzz.ratio).  Channels with a time on the end,
+  # for common locations like Starbucks, only match the same time.
+  def channelByNameFuzzy(self, name, threshold):
+    date = self.channelDate(name)
+    if date is None:
+      return None
+    match = EX_CHANNEL_TIME_RE.search(name)
+    time = match.group(1) if match else None
+
+    best = None
+    for channel_id in self.dateIds.get(date, ()):
+      channel = self.channel(channel_id)
+      if channel is None:
+        continue
+      match = EX_CHANNEL_TIME_RE.search(channel.name)
+      if (match.group(1) if match else None) != time:
+        continue
+      score = fuzz.ratio(channel.name, name)
+      if score >= threshold and (best is None or score > best[1]):
+        best = (channel, score)
+    return best
+
+  # All of the channels in a category
+  def children(self, category_id):
+    channels = [self.channel(i) for i in self.childIds.get(category_id, ())]
+    return [c for c in channels if c is not None]
+
+  def channels(self):
+    channels = [self.channel(i) for i in self.channelNames]
+    return [c for c in channels if c is not None]
+
+  def roleByName(self, name):
+    for role_id in self.roleIds.get(name, ()):
+      role = self.guild.roles.get(role_id)
+      if role is not None:
+        return role
+    return None
+
+# The indexes for every guild the bot has looked anything up in
+class pokeindex:
+  def __init__(self):
+    self.guilds = {}
+
+  # disco replaces a guild's object each time the guild is (re)loaded, e.g.
+  # after reconnecting, and only keeps the new one current.  An index built
+  # from an older object is rebuilt.
+  def forGuild(self, guild):
+    index = self.guilds.get(guild.id)
+    if index is None or index.guild is not guild:
+      index = self.guildLoaded(guild)
+    return index
+
+  def guildLoaded(self, guild):
+    index = self.guilds[guild.id] = guildIndex(guild)
+    return index
+
+  # Event hooks.  Guilds that haven't been indexed yet are ignored; they'll
+  # be read in full when they're first used.
+
+  # Called with a channel the bot just created, so it can be found before
+  # the gateway's ChannelCreate arrives
+  def channelCreated(self, guild, channel):
+    self.forGuild(guild).addCreatedChannel(channel)
+
+  def channelChanged(self, channel):
+    index = self.guilds.get(channel.guild_id)
+    if index is not None:
+      index.addChannel(channel)
+
+  def channelDeleted(self, channel):
+    index = self.guilds.get(channel.guild_id)
+    if index is not None:
+      index.removeChannel(channel.id)
+
+  def roleChanged(self, guild_id, role):
+    index = self.guilds.get(guild_id)
+    if index is not None:
+      index.addRole(role)
+
+  def roleDeleted(self, guild_id, role_id):
+    index = self.guilds.get(guild_id)
+    if index is not None:
+      index.removeRole(role_id)
+
+  def guildDeleted(self, guild_id):
+    self.guilds.pop(guild_id, None)
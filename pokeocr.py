@@ -1,19 +1,41 @@
 # This Python file uses the following encoding: utf-8
 from PIL import Image
-import pyocr
-import pyocr.builders
 import cv2
 import sys
 import re
 import unicodedata
 import json
 import calendar
-from cv2utils import cv2utils
-import dateparser
+import collections
+import threading
+from cv2utils import cv2utils, scalingTemplate, scaleCache, preprocessContext
+from poketimer import poketimer
+from pokegyms import pokegyms
 
 
 COMBINE_SPACES_RE = re.compile('\s{1,}').sub
 
+# The invite's date/time line, e.g. "September 2 11:00 AM - 11:45 AM" or
+# "2 September 11:00 - 11:45".  Digits may have been misread as letters, which
+# fix_ocr_digit_mistakes sorts out.
+OCR_DIGIT = ur'[0-9SZOlI|]'
+OCR_TIME = ur'(%s{1,2})\s*[:.]\s*(%s{2})\s*(?:([AaPp])\.?\s*[Mm]\.?)?' % (OCR_DIGIT, OCR_DIGIT)
+DATETIME_LINE_RE = re.compile(
+  ur'^\s*(?:([A-Za-z]{3,})\.?\s*(%s{1,2})|(%s{1,2})\s*([A-Za-z]{3,})\.?)\s+%s\s*[-~\u2013\u2014]+\s*%s' %
+  (OCR_DIGIT, OCR_DIGIT, OCR_TIME, OCR_TIME), re.UNICODE)
+# Just a time, e.g. "5:00PM"
+TIME_RE = re.compile(ur'^\s*%s\s*$' % OCR_TIME, re.UNICODE)
+
+# First three letters of each month -> month number
+MONTH_NUMBERS = {calendar.month_name[m][:3].lower(): m for m in range(1, 13)}
+
+# The height of the smallest lowercase letters on the card (the location
+# line), as a fraction of the width of the cropped card
+CARD_X_HEIGHT = 0.018
+
+# Everything that can appear in the date/time line
+DATETIME_LINE_CHARS = ''.join(sorted(set(''.join(calendar.month_name[1:]) + '0123456789:-AMP')))
+
 class InvalidCityException(Exception):
   pass
 
@@ -33,13 +55,127 @@ class TooFewLinesException(Exception):
   pass
 
 
+# OCR backends.  Each one picks a language and turns a PIL image into text.
+# `threaded` says whether it can be used from native threads, like the
+# plugin's worker pool.
+
+# Runs the first tool pyocr finds.  With the tesseract tool, this starts a new
+# tesseract process (which reloads its trained data) for every image.
+#
+# Under gevent, processes can only be started from the main thread, so this
+# engine mustn't be used from the worker pool.  It doesn't need to be: the
+# greenlets waiting on tesseract processes don't block each other, so
+# several images are still OCRed at once.
+class pyocrEngine:
+  threaded = False
+
+  def __init__(self, preferred_language=None):
+    import pyocr
+    import pyocr.builders
+    self.builders = pyocr.builders
+    self.tool = pyocr.get_available_tools()[0]
+
+    available_languages = self.tool.get_available_languages()
+    if preferred_language is not None and preferred_language in available_languages:
+      self.lang = preferred_language
+    else:
+      self.lang = available_languages[0]
+
+  # With line=True the image is read as a single line of text.  whitelist
+  # limits which characters tesseract will return; only the tesseract
+  # command line tool supports it.
+  def image_to_string(self, pil, line=False, whitelist=None):
+    if line:
+      builder = self.builders.TextBuilder(tesseract_layout=7)
+    else:
+      builder = self.builders.TextBuilder()
+    if whitelist:
+      builder.tesseract_flags += ['-c', 'tessedit_char_whitelist=' + whitelist]
+    return self.tool.image_to_string(
+      pil,
+      lang=self.lang,
+      builder=builder
+    )
+
+# Keeps a pool of tesseract API handles, each initialised once with the
+# trained data for our language.  Recognition releases the GIL, so images
+# scanned on different worker threads are OCRed in parallel.  Handles are
+# created on demand if more threads than expected need one at the same time.
+class tesserocrEngine:
+  threaded = True
+
+  def __init__(self, preferred_language=None, workers=2):
+    import tesserocr
+    self.tesserocr = tesserocr
+
+    (self.path, available_languages) = tesserocr.get_languages()
+    if preferred_language is not None and preferred_language in available_languages:
+      self.lang = preferred_language
+    else:
+      self.lang = available_languages[0]
+
+    # deque append/pop are atomic, so the pool is safe to share between
+    # threads without a lock
+    self.idle = collections.deque()
+    for i in range(workers):
+      self.idle.append(self.newApi())
+
+  def newApi(self):
+    return self.tesserocr.PyTessBaseAPI(path=self.path, lang=self.lang)
+
+  def image_to_string(self, pil, line=False, whitelist=None):
+    try:
+      api = self.idle.pop()
+    except IndexError:
+      api = self.newApi()
+    try:
+      if line:
+        api.SetPageSegMode(self.tesserocr.PSM.SINGLE_LINE)
+      if whitelist:
+        api.SetVariable('tessedit_char_whitelist', whitelist)
+      api.SetImage(pil)
+      return api.GetUTF8Text()
+    finally:
+      api.Clear()
+      # Put the handle back the way newApi made it
+      api.SetPageSegMode(self.tesserocr.PSM.AUTO)
+      api.SetVariable('tessedit_char_whitelist', '')
+      self.idle.append(api)
+
+def createOcrEngine(name, preferred_language=None, workers=2):
+  if name == 'tesserocr':
+    try:
+      return tesserocrEngine(preferred_language, workers)
+    except ImportError:
+      print('Warning: tesserocr is not installed, falling back to pyocr')
+  return pyocrEngine(preferred_language)
+
+
 class pokeocr:
-  def __init__(self, location_regex):
+  def __init__(self, location_regex, config_file='config/exraid.json'):
     self.preferred_language = None
     self.gym_name_corrections = {}
-    with open('config/exraid.json', 'r') as fp:
+    self.template_match_mode = 'exhaustive'
+    self.template_match_confidence = 0.5
+    self.ocr_layout = 'block'
+    self.ocr_x_height = None
+    scale_cache_file = None
+    gym_gazetteer_file = None
+    gym_match_threshold = 85
+    ocr_engine = 'pyocr'
+    ocr_workers = 2
+    with open(config_file, 'r') as fp:
       json_data = json.load(fp)
       self.preferred_language = json_data.get('preferred_language')
+      ocr_engine = json_data.get('ocr_engine', ocr_engine)
+      ocr_workers = json_data.get('ocr_workers', json_data.get('processing_workers', ocr_workers))
+      self.template_match_mode = json_data.get('template_match_mode', self.template_match_mode)
+      self.template_match_confidence = json_data.get('template_match_confidence', self.template_match_confidence)
+      scale_cache_file = json_data.get('scale_cache_file')
+      self.ocr_layout = json_data.get('ocr_layout', self.ocr_layout)
+      self.ocr_x_height = json_data.get('ocr_x_height', self.ocr_x_height)
+      gym_gazetteer_file = json_data.get('gym_gazetteer_file')
+      gym_match_threshold = json_data.get('gym_match_threshold', gym_match_threshold)
 
       if 'gym_name_corrections' in json_data and isinstance(json_data['gym_name_corrections'], dict):
         # Use a dictionary comprehension to flip the dictionary around.  The "correction_name" should be
@@ -50,14 +186,21 @@ class pokeocr:
           for correction_name in correction_names
         }
 
-    # Get the first available tool
-    self.tool = pyocr.get_available_tools()[0]
+    self.scale_cache = scaleCache(scale_cache_file)
+    self.contexts = threading.local()
 
-    available_languages = self.tool.get_available_languages()
-    if self.preferred_language is not None and self.preferred_language in available_languages:
-      self.lang = self.preferred_language
-    else:
-      self.lang = self.tool.get_available_languages()[0]
+    # Known gyms to snap OCRed names to, if there's a list of them
+    self.gyms = None
+    if gym_gazetteer_file:
+      self.gyms = pokegyms.fromFile(gym_gazetteer_file, gym_match_threshold)
+
+    # Finding tesseract and its languages runs several processes (or loads
+    # the trained data, for tesserocr), so it waits until the engine is first
+    # needed or warmup is called
+    self.ocr_engine = ocr_engine
+    self.ocr_workers = ocr_workers
+    self.engine = None
+    self.engineLock = threading.Lock()
 
     self.dateTimeRE = re.compile('^([A-Z][a-z]+)\s+?([0-9]{1,2})\s+([0-9]{1,2}:[0-9]{2} ?[AP]M) .+ ([0-9]{1,2}:[0-9]{2} ?[AP]M)')
     self.cityRE = re.compile(location_regex)
@@ -66,6 +209,17 @@ class pokeocr:
     self.short_months_to_known_months = {calendar.month_name[a][:3].lower(): calendar.month_name[a] for a in range(1, 13)}
     self.long_month_names = [calendar.month_name[a].lower() for a in range(1,13)]
 
+  def getEngine(self):
+    if self.engine is None:
+      with self.engineLock:
+        if self.engine is None:
+          self.engine = createOcrEngine(self.ocr_engine, self.preferred_language, self.ocr_workers)
+    return self.engine
+
+  # Does the slow setup now rather than on the first scan
+  def warmup(self):
+    self.getEngine()
+
   @staticmethod
   def isMatchCentered(width, startx, endx):
     matchw = endx - startx
@@ -140,17 +294,63 @@ class pokeocr:
     # print('>>> New String >>> %s' % a_string)
     return a_string
 
-  def cropExRaidImage(self, image, topleft, bottom, debug=False):
+  # If a timer is given, the time spent matching is recorded along with how
+  # the templates were found, how well they matched and at what scale
+  def cropExRaidImage(self, image, topleft, bottom, debug=False, timer=None):
+    timer = timer or poketimer()
     height, width = image.shape[:2]
 
-    # Run the scaling matcher to find the template, then sanity check the
-    # match
-    ((tl_left, tl_top), (tl_right, tl_bottom)) = cv2utils.scalingMatch(topleft, image)
-    ((b_left, b_top), (b_right, b_bottom)) = cv2utils.scalingMatch(bottom, image)
+    # Callers should pass preprocessed scalingTemplates so the templates
+    # aren't re-prepared for every image, but raw images still work
+    topleft = scalingTemplate.wrap(topleft)
+    bottom = scalingTemplate.wrap(bottom)
+
+    with timer.stage('match'):
+      # Screenshots with the same resolution almost always have the templates
+      # in the same place, so first try to verify where we found them last
+      # time.  The remembered boxes are used as they are, so the same
+      # screenshot is always cropped the same way, and the cache only
+      # changes after a full search.
+      templates = [topleft, bottom]
+      boxes = None
+      scored = None
+      searched = False
+      cached = self.scale_cache.get(width, height, templates)
+      if cached is not None:
+        scored = cv2utils.scoreMatch(templates, image, cached)
+        if scored is not None and min([score for (score, box) in scored]) >= self.template_match_confidence:
+          boxes = cached
+          timer.note(match='cache')
+
+      # Otherwise run the scaling matcher to find both templates in a single
+      # pass over the image
+      if boxes is None:
+        scored = None
+        searched = True
+        if self.template_match_mode == 'coarse_to_fine':
+          boxes = cv2utils.coarseToFineMatch(templates, image, self.template_match_confidence)
+        else:
+          boxes = cv2utils.multiScalingMatch(templates, image)
+        timer.note(match=self.template_match_mode)
+
+    if timer.enabled():
+      # The matchers' raw scores aren't comparable between images, so score
+      # the boxes again, normalized
+      if scored is None:
+        scored = cv2utils.scoreMatch(templates, image, boxes)
+      if scored is not None:
+        timer.note(confidence=tuple([score for (score, box) in scored]))
+      timer.note(scale=tuple([t.width / float(max(1, b[1][0] - b[0][0])) for t, b in zip(templates, boxes)]))
+
+    # Sanity check the match
+    (((tl_left, tl_top), (tl_right, tl_bottom)),
+     ((b_left, b_top), (b_right, b_bottom))) = boxes
     if not debug:
       val = self.isMatchCentered(width, b_left, b_right)
       if val != True:
         raise MatchNotCenteredException('Bottom template match not centered. Starts at ' + str(b_left) + ', should be ' + str(val))
+      if searched:
+        self.scale_cache.put(width, height, templates, boxes)
 
     # Let's assume that the right offset is the same as the left. We could
     # match on a top-right image, but it would tank performance even more.
@@ -159,29 +359,118 @@ class pokeocr:
     # Crop the image
     return image[tl_bottom:b_top,tl_left:right]
 
-  def scanExRaidImage(self, image, topleft, bottom, useCity=True, debug=False):
-    image = self.cropExRaidImage(image, topleft, bottom)
+  def scanExRaidImage(self, image, topleft, bottom, useCity=True, debug=False, timer=None):
+    timer = timer or poketimer()
+    image = self.cropExRaidImage(image, topleft, bottom, timer=timer)
+    return self.scanCroppedImage(image, useCity, debug, timer)
+
+  # How much to scale a card that's `width` pixels wide before OCR.  With
+  # ocr_x_height set, that's whatever makes its smallest lowercase letters
+  # that many pixels tall.
+  def ocrScale(self, width):
+    if not self.ocr_x_height:
+      return 3
+    return min(4.0, max(0.5, self.ocr_x_height / (width * CARD_X_HEIGHT)))
+
+  # Each worker thread gets its own preprocessContext, so the CLAHE instance
+  # and scratch buffers are reused from one image to the next
+  def context(self):
+    context = getattr(self.contexts, 'context', None)
+    if context is None:
+      context = self.contexts.context = preprocessContext()
+    return context
+
+  # Prepares a cropped invite, or part of one, for OCR.  Returns a PIL image.
+  # scale defaults to ocrScale of the image's width.
+  def preprocess(self, image, scale=None):
+    if scale is None:
+      scale = self.ocrScale(image.shape[1])
+    context = self.context()
+
+    if self.ocr_x_height:
+      # Only the luminance matters to OCR, so convert to grayscale first and
+      # then resize and increase the contrast of a single channel
+      image = context.gray(image)
+      if scale > 1:
+        image = context.resize(image, scale, cv2.INTER_CUBIC)
+      elif scale < 1:
+        image = context.resize(image, scale, cv2.INTER_AREA)
+      return Image.fromarray(context.increaseGrayContrast(image))
 
     # Scale up, which oddly helps with OCR
-    height, width = image.shape[:2]
-    image = cv2.resize(image, (0,0), fx=3, fy=3, interpolation=cv2.INTER_CUBIC)
+    image = context.resize(image, scale, cv2.INTER_CUBIC)
 
     # Increase contrast. Must be done before grayscale conversion
-    image = cv2utils.increaseContrast(image)
+    image = context.increaseContrast(image, context.buffer('contrast', image.shape))
 
     # Convert to grayscale
     image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
 
     # Convert to PIL format
-    pil = Image.fromarray(image)
-    # pil.show()
-
-    # OCR the text
-    txt = self.tool.image_to_string(
-      pil, 
-      lang=self.lang, 
-      builder=pyocr.builders.TextBuilder()
-    )
+    return Image.fromarray(image)
+
+  # The card's layout is always the same: the date/time line, the gym name
+  # (which may wrap), the location and the "Get directions" button.  Returns
+  # the (top, bottom, left, right) boxes of the date/time line, each line of
+  # the gym name and the location, or None if the card doesn't look like
+  # that.  The button is never returned.
+  def findLines(self, image):
+    lines = cv2utils.textLines(image)
+    if len(lines) < 3:
+      return None
+    return {'datetime': lines[0], 'gym': lines[1:-1], 'city': lines[-1]}
+
+  # The OCR half of scanExRaidImage, for an image that's already been cropped
+  # by cropExRaidImage
+  def scanCroppedImage(self, image, useCity=True, debug=False, timer=None):
+    timer = timer or poketimer()
+    return self.readPreparedImage(self.prepareCroppedImage(image, timer), useCity, debug, timer)
+
+  # The cv2 half of scanCroppedImage: finds the lines to OCR and preprocesses
+  # them.  Returns a list of lines, each a list of (PIL image, whether it's a
+  # single line, character whitelist) to OCR and join with spaces.  Unless
+  # ocr_layout is "lines" (and the lines are found), that's just the whole
+  # card.
+  def prepareCroppedImage(self, image, timer=None):
+    timer = timer or poketimer()
+    lines = None
+    if self.ocr_layout == 'lines':
+      lines = self.findLines(image)
+    timer.note(layout='lines' if lines else 'block')
+
+    if not lines:
+      with timer.stage('preprocess'):
+        return [[(self.preprocess(image), False, None)]]
+
+    # Each line is scaled as part of the whole card, not by its own width
+    scale = self.ocrScale(image.shape[1])
+    prepared = []
+    for (boxes, whitelist) in (([lines['datetime']], DATETIME_LINE_CHARS),
+                               (lines['gym'], None),
+                               ([lines['city']], None)):
+      parts = []
+      for (top, bottom, left, right) in boxes:
+        with timer.stage('preprocess'):
+          parts.append((self.preprocess(image[top:bottom, left:right], scale), True, whitelist))
+      prepared.append(parts)
+    return prepared
+
+  # The OCR half of scanCroppedImage: OCRs what prepareCroppedImage returned
+  # and parses the text.  With pyocr this starts tesseract processes, which
+  # under gevent can only be done from the main thread (see the engines'
+  # `threaded`).
+  def readPreparedImage(self, prepared, useCity=True, debug=False, timer=None):
+    timer = timer or poketimer()
+    engine = self.getEngine()
+    text = []
+    for parts in prepared:
+      words = []
+      for (pil, line, whitelist) in parts:
+        with timer.stage('ocr'):
+          txt = engine.image_to_string(pil, line=line, whitelist=whitelist)
+        words.append(txt.strip() if line else txt)
+      text.append(' '.join(words))
+    txt = u'\n'.join(text)
 
     # text_two = self.tool.image_to_string(
     #   pil,
@@ -197,6 +486,16 @@ class pokeocr:
     #
     # return
 
+    with timer.stage('parse'):
+      ret = self.parseText(txt, useCity, debug, timer)
+    if isinstance(ret, exRaidData):
+      ret.confidence = timer.info.get('confidence')
+      ret.timings = dict(timer.stages)
+    return ret
+
+  # Turns the OCRed text of a cropped invite into an exRaidData
+  def parseText(self, txt, useCity=True, debug=False, timer=None):
+    timer = timer or poketimer()
     # Replace any non-ASCII unicode characters with their closest
     # equivalents.  This is bad news for i18n, but helps us with a lot of
     # OCR issues
@@ -265,8 +564,10 @@ class pokeocr:
     # new_lines = []
     # for line in lines:
     #   print(line)
+    with timer.stage('dateparse'):
+      datetime_line = normalize_datetime_line(structured_lines['datetime_line'])
     lines = [
-      normalize_datetime_line(structured_lines['datetime_line']),
+      datetime_line,
       structured_lines['gym_line'],
       structured_lines['city_line'],
       'Get directions'
@@ -347,11 +648,98 @@ class pokeocr:
     if not match:
       raise InvalidGetDirectionsException('Get directions did not match: ' + lines[gdindex].encode('utf-8'))
 
+    # Use the known gym closest to what we read, so a misread name still
+    # ends up in the same channel as everyone else's
+    if self.gyms is not None:
+      with timer.stage('gym_lookup'):
+        found = self.gyms.lookup(ret.location, getattr(ret, 'city', None))
+      if found is not None:
+        (gym, score) = found
+        timer.note(gym_score=score)
+        ret.location = gym.name
+
     return ret
 
-class exRaidData:
+# What we read from an invite.  The date and times are stored as numbers:
+# monthNumber (1-12), dayNumber, and beginMinutes/endMinutes counted from
+# midnight.  month, day, begin and end give (and take) them as the strings
+# we've always used, e.g. 'September', '9' and '5:00PM'.  confidence is the
+# normalized template match scores, if they were measured, and timings is
+# how long each stage of the scan took.
+#
+# Fields that weren't read aren't set, so e.g. raidInfo.city raises
+# AttributeError when the invite had no city line.  toDict and fromDict
+# convert to and from plain JSON types.
+class exRaidData(object):
+  __slots__ = ('monthNumber', 'dayNumber', 'beginMinutes', 'endMinutes', 'location', 'city', 'confidence', 'timings')
+
   def __init__(self, **kwargs):
-    self.__dict__.update(kwargs)
+    for key, value in kwargs.iteritems():
+      setattr(self, key, value)
+
+  @property
+  def month(self):
+    return calendar.month_name[self.monthNumber]
+
+  @month.setter
+  def month(self, name):
+    number = MONTH_NUMBERS.get(name[:3].lower())
+    if number is None:
+      raise ValueError('Unknown month: ' + name.encode('utf-8'))
+    self.monthNumber = number
+
+  @property
+  def day(self):
+    return str(self.dayNumber)
+
+  @day.setter
+  def day(self, day):
+    self.dayNumber = int(day)
+
+  @property
+  def begin(self):
+    return format_minutes(self.beginMinutes).replace(' ', '')
+
+  @begin.setter
+  def begin(self, begin):
+    self.beginMinutes = parse_time(begin)
+
+  @property
+  def end(self):
+    return format_minutes(self.endMinutes).replace(' ', '')
+
+  @end.setter
+  def end(self, end):
+    self.endMinutes = parse_time(end)
+
+  def toDict(self):
+    return {key: getattr(self, key) for key in self.__slots__ if hasattr(self, key)}
+
+  # Also takes the dicts older versions saved, with month, day, begin and
+  # end as strings
+  @classmethod
+  def fromDict(cls, data):
+    return cls(**data)
+
+  def copy(self):
+    return self.fromDict(self.toDict())
+
+  # Slotted objects have no __dict__ for pickle to use
+  def __getstate__(self):
+    return self.toDict()
+
+  def __setstate__(self, state):
+    for key, value in state.iteritems():
+      setattr(self, key, value)
+
+  def __eq__(self, other):
+    return isinstance(other, exRaidData) and self.toDict() == other.toDict()
+
+  def __ne__(self, other):
+    return not self == other
+
+  def __repr__(self):
+    return 'exRaidData(%s)' % ', '.join('%s=%r' % item for item in sorted(self.toDict().iteritems()))
 
 
 def fix_ocr_digit_mistakes(ocr_string):
@@ -363,25 +751,96 @@ def fix_ocr_digit_mistakes(ocr_string):
   :return: Corrected String
   :rtype: str
   """
-  return ocr_string.replace('S', '5').replace('Z', '2')
+  return ocr_string.replace('S', '5').replace('Z', '2').replace('O', '0') \
+    .replace('l', '1').replace('I', '1').replace('|', '1')
 
 
-def normalize_datetime_line(some_string):
+def parse_datetime_line(some_string):
   """
-  Take a date string in two formats (12/24hrs as well) and turn it into a normalized
-  string that US English uses in the PoGo Client.
+  Parse an invite's date/time line with DATETIME_LINE_RE.  Handles both day
+  orders, 12 and 24 hour times and commonly misread digits.
 
-  >>> normalize_datetime_line('9 september 17:00 - 17:45')
-    September 9 5:00 PM - 5:45 PM
-
-  >>> normalize_datetime_line('September 2 11:00AM - 11:45AM')
-    September 2 11:00 AM - 11:45 AM
+  >>> parse_datetime_line('9 september 17:00 - 17:45')
+    (9, 9, 1020, 1065)
 
   :param some_string:
   :type some_string: str
-  :return:
+  :return: (month, day, start minute, end minute) with the minutes counted
+    from midnight, or None if the line can't be parsed
+  :rtype: tuple
+  """
+  match = DATETIME_LINE_RE.match(some_string)
+  if not match:
+    return None
+  (month_a, day_a, day_b, month_b,
+   start_hour, start_minute, start_half,
+   end_hour, end_minute, end_half) = match.groups()
+
+  month = MONTH_NUMBERS.get((month_a or month_b)[:3].lower())
+  day = int(fix_ocr_digit_mistakes(day_a or day_b))
+  start = to_minutes(start_hour, start_minute, start_half)
+  end = to_minutes(end_hour, end_minute, end_half)
+  if month is None or not 1 <= day <= 31 or start is None or end is None:
+    return None
+  return (month, day, start, end)
+
+
+def to_minutes(hour, minute, half=None):
+  """
+  Minutes since midnight for an OCRed time.  half is 'A' or 'P' for 12 hour
+  times, or None for 24 hour times.  Returns None if the time is impossible.
+  """
+  hour = int(fix_ocr_digit_mistakes(hour))
+  minute = int(fix_ocr_digit_mistakes(minute))
+  if minute > 59 or hour > 23:
+    return None
+  # A 24 hour time with AM/PM after it is still a 24 hour time
+  if half is not None and 1 <= hour <= 12:
+    hour = hour % 12
+    if half in 'Pp':
+      hour += 12
+  return hour * 60 + minute
+
+
+def parse_time(some_string):
+  """
+  Parses a time the way it appears in the date/time line, e.g. '5:00PM',
+  '5:00 PM' or '17:00'.
+
+  :return: minutes since midnight
+  :rtype: int
+  """
+  match = TIME_RE.match(some_string)
+  minutes = to_minutes(match.group(1), match.group(2), match.group(3)) if match else None
+  if minutes is None:
+    raise ValueError('Unknown time: ' + some_string.encode('utf-8'))
+  return minutes
+
+
+def format_minutes(minutes):
+  """
+  Formats minutes since midnight the way the game does, e.g. 1020 -> '5:00 PM'
+  """
+  (hour, minute) = divmod(minutes, 60)
+  return '%d:%02d %s' % ((hour + 11) % 12 + 1, minute, 'PM' if hour >= 12 else 'AM')
+
+
+def parse_datetime_line_with_dateparser(some_string):
   """
+  The old way of parsing the date/time line, for lines parse_datetime_line
+  can't handle.  Needs the optional dateparser module, which is slow to
+  import and slow to run, so it's only loaded the first time it's needed.
+
+  :return: the same as parse_datetime_line
+  """
+  try:
+    import dateparser
+  except ImportError:
+    return None
+
   parts = combine_spaces(some_string).replace(' PM', 'PM').replace(' AM', 'AM').split(' ')
+  if len(parts) < 5:
+    return None
 
   # 0 = month or day
   # 1 = month or day
@@ -389,46 +848,40 @@ def normalize_datetime_line(some_string):
   # 3 = ***DASH***
   # 4 = end time
 
-  # Apply fixes for commonly mistaken digits
-  if parts[0].isdigit():
-    parts[0] = fix_ocr_digit_mistakes(parts[0])
-
-  if parts[1].isdigit():
-    parts[1] = fix_ocr_digit_mistakes(parts[1])
-
   for index in range(0, len(parts)):
     if parts[index].find(':') > 0:
       parts[index] = fix_ocr_digit_mistakes(parts[index])
 
-  start_string = ' '.join([
-    parts[0],
-    parts[1],
-    parts[2]
-  ])
-  end_string = ' '.join([
-    parts[0],
-    parts[1],
-    parts[4]
-  ])
-
-  start = dateparser.parse(start_string)
-  end = dateparser.parse(end_string)
-
-  # print('*> Start String *> %s' % start_string)
-  # print('*> End String   *> %s' % end_string)
-
-  # print('|> Parts |> %s' % parts)
-  # print('// START // %s' % start)
-  # print('// END   // %s' % end)
-
-  # Terrible python hack since Python 2.7 doesn't understand the concept
-  # of non-zero-prefixed datetime stuff.  So annoying.
-  return '{month} {day} {start_time} - {end_time}'.format(
-    month=start.strftime('%B'),
-    day=start.strftime('X%d'),
-    start_time=start.strftime('X%I:%M %p'),
-    end_time=end.strftime('X%I:%M %p')
-  ).replace('X0', 'X').replace('X', '')
+  start = dateparser.parse(' '.join([parts[0], parts[1], parts[2]]))
+  end = dateparser.parse(' '.join([parts[0], parts[1], parts[4]]))
+  if start is None or end is None:
+    return None
+  return (start.month, start.day, start.hour * 60 + start.minute, end.hour * 60 + end.minute)
+
+
+def normalize_datetime_line(some_string):
+  """
+  Take a date string in two formats (12/24hrs as well) and turn it into a normalized
+  string that US English uses in the PoGo Client.
+
+  >>> normalize_datetime_line('9 september 17:00 - 17:45')
+    September 9 5:00 PM - 5:45 PM
+
+  >>> normalize_datetime_line('September 2 11:00AM - 11:45AM')
+    September 2 11:00 AM - 11:45 AM
+
+  :param some_string:
+  :type some_string: str
+  :return:
+  """
+  if not some_string:
+    raise InvalidDateTimeException('No date/time line found')
+  parsed = parse_datetime_line(some_string) or parse_datetime_line_with_dateparser(some_string)
+  if parsed is None:
+    raise InvalidDateTimeException('Date/time line could not be parsed: ' + some_string.encode('utf-8'))
+
+  (month, day, start, end) = parsed
+  return '%s %d %s - %s' % (calendar.month_name[month], day, format_minutes(start), format_minutes(end))
 
 
 def combine_spaces(a_string):
@@ -0,0 +1,76 @@
+import gevent
+import gevent.lock
+import traceback
+from gevent.queue import Queue
+from gevent.threadpool import ThreadPool
+
+# Moves invite processing off of the gateway event handlers.  Work happens in
+# two stages:
+#
+# - scan: downloading and CV work.  Runs on a pool of native threads, so
+#   several images are processed at once.  OpenCV releases the GIL, so this
+#   scales with cores.  Nothing run here may start a process: under gevent,
+#   only the main thread can.
+#
+# - mutate: Discord changes.  Runs in greenlets, with everything queued under
+#   the same key (e.g. a channel name) running one at a time, in the order it
+#   was queued.  That keeps two invites for the same new raid from both
+#   creating its channel.
+class pokepipeline:
+  def __init__(self, workers=2):
+    # With no workers, scans run inline in the calling greenlet
+    if workers > 0:
+      self.pool = ThreadPool(workers)
+    else:
+      self.pool = None
+    self.queues = {}
+    self.locks = {}
+
+  # Runs a handler in its own greenlet so the event dispatcher can move on
+  def submit(self, func, *args, **kwargs):
+    return gevent.spawn(self.run, func, *args, **kwargs)
+
+  @staticmethod
+  def run(func, *args, **kwargs):
+    try:
+      func(*args, **kwargs)
+    except Exception:
+      traceback.print_exc()
+
+  # Runs func on the worker pool and returns its result.  Only the calling
+  # greenlet waits; exceptions are re-raised in it.
+  def scan(self, func, *args, **kwargs):
+    if self.pool is None:
+      return func(*args, **kwargs)
+    return self.pool.apply(func, args, kwargs)
+
+  # Queues func to run in the Discord stage after anything already queued
+  # under the same key
+  def mutate(self, key, func, *args, **kwargs):
+    queue = self.queues.get(key)
+    if queue is None:
+      queue = self.queues[key] = Queue()
+      queue.put((func, args, kwargs))
+      gevent.spawn(self.drain, key, queue)
+    else:
+      queue.put((func, args, kwargs))
+
+  def drain(self, key, queue):
+    while not queue.empty():
+      (func, args, kwargs) = queue.get()
+      self.run(func, *args, **kwargs)
+    # Nothing can be queued between the empty() check and here, since there's
+    # no greenlet switch in between
+    del self.queues[key]
+
+  # A lock for work that's shared between keys, e.g. creating a category that
+  # several raid channels live in
+  def lock(self, key):
+    lock = self.locks.get(key)
+    if lock is None:
+      lock = self.locks[key] = gevent.lock.Semaphore()
+    return lock
+
+  # How many keys have Discord work waiting or running
+  def pending(self):
+    return len(self.queues)
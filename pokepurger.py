@@ -0,0 +1,109 @@
+import gevent
+import gevent.event
+import heapq
+import random
+import time
+import traceback
+
+from pokediscord import pokediscord
+from pokerest import pokerest
+
+# Deletes raid channels and categories once they're old_channel_grace_days
+# past their raid.  Each channel's expiry is worked out once, when the
+# channel is first seen, and a background greenlet sleeps until the next one
+# is due.  That keeps the per-message work down to nothing.
+#
+# Expiries get up to `jitter` seconds added so a day's worth of channels
+# aren't all deleted at the same instant, and deletions are spaced `interval`
+# seconds apart so a backlog doesn't eat the rate limit that user-facing
+# replies need.
+class pokepurger:
+  def __init__(self, graceDays, jitter=300, interval=1.0):
+    self.graceDays = graceDays
+    self.jitter = jitter
+    self.interval = interval
+    # channel id -> (expiry, guild, name).  The heap holds (expiry, channel
+    # id) and may have stale entries, which are skipped when popped.
+    self.channels = {}
+    self.heap = []
+    self.wakeup = gevent.event.Event()
+    self.greenlet = None
+
+  def enabled(self):
+    return self.graceDays != -1
+
+  def start(self):
+    if self.enabled() and self.greenlet is None:
+      self.greenlet = gevent.spawn(self.run)
+
+  def stop(self):
+    if self.greenlet is not None:
+      self.greenlet.kill()
+      self.greenlet = None
+
+  # Starts tracking a channel, or updates it if it's been renamed
+  def track(self, guild, channel, now=None):
+    if not self.enabled():
+      return
+    expiry = pokediscord.channelExpiry(channel.name, self.graceDays, now)
+    if expiry is None:
+      self.channels.pop(channel.id, None)
+      return
+    old = self.channels.get(channel.id)
+    if old is not None and old[2] == channel.name:
+      return
+    expiry += random.uniform(0, self.jitter)
+    self.channels[channel.id] = (expiry, guild, channel.name)
+    heapq.heappush(self.heap, (expiry, channel.id))
+    # Wake the greenlet in case this is now the next channel due
+    self.wakeup.set()
+
+  def untrack(self, channel_id):
+    self.channels.pop(channel_id, None)
+
+  # Pops and returns the (guild, channel id) of everything due by now
+  def due(self, now=None):
+    now = now or time.time()
+    due = []
+    while self.heap and self.heap[0][0] <= now:
+      (expiry, channel_id) = heapq.heappop(self.heap)
+      entry = self.channels.get(channel_id)
+      if entry is None or entry[0] != expiry:
+        continue
+      del self.channels[channel_id]
+      due.append((entry[1], channel_id))
+    return due
+
+  # Seconds until the next channel is due, or None if there aren't any
+  def nextDue(self, now=None):
+    now = now or time.time()
+    while self.heap and self.heap[0][1] not in self.channels:
+      heapq.heappop(self.heap)
+    if not self.heap:
+      return None
+    return max(0, self.heap[0][0] - now)
+
+  def run(self):
+    with pokerest.housekeeping():
+      while True:
+        self.wakeup.clear()
+        for (guild, channel_id) in self.due():
+          self.purge(guild, channel_id)
+          gevent.sleep(self.interval)
+        self.wakeup.wait(self.nextDue())
+
+  def purge(self, guild, channel_id):
+    channel = guild.channels.get(channel_id)
+    if channel is None:
+      return
+    # Make sure it wasn't renamed to something that shouldn't be deleted yet
+    expiry = pokediscord.channelExpiry(channel.name, self.graceDays)
+    if expiry is None or expiry > time.time():
+      return
+    try:
+      channel.delete()
+    except Exception:
+      traceback.print_exc()
+
+  def __len__(self):
+    return len(self.channels)
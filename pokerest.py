@@ -0,0 +1,183 @@
+import contextlib
+import gevent
+import gevent.event
+import gevent.local
+import heapq
+import itertools
+import time
+import traceback
+
+from pokeutil import histogram, writeAtomically
+
+# Greenlet-local priority for outgoing Discord requests, see
+# pokerest.housekeeping()
+_context = gevent.local.local()
+
+# Latency histogram bucket bounds, in seconds
+LATENCY_BOUNDS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Per-route request counters and latency histogram
+class routeStats:
+  def __init__(self):
+    self.calls = 0
+    self.errors = 0
+    self.housekeeping = 0
+    self.waited = 0.0
+    self.latency = histogram(LATENCY_BOUNDS)
+
+# Sits between disco's APIClient and its HTTPClient, so it sees every REST
+# request the bot makes.  It:
+#
+# - limits how many requests are in flight at once, and when requests have
+#   to queue, sends user-facing ones (replies, joins) before housekeeping
+#   (reordering, roster edits, purges).
+#
+# - holds housekeeping requests back while their rate limit bucket is down to
+#   its last `reserve` requests, leaving those for user-facing requests.
+#
+# - counts requests, errors and time spent per route (method plus the URL
+#   template, so not one series per channel), which can be written out
+#   periodically in the Prometheus text format.
+#
+# disco's own rate limiter still does the actual waiting for exhausted
+# buckets.
+class pokerest:
+  USER = 0
+  HOUSEKEEPING = 1
+
+  def __init__(self, http, concurrency=4, reserve=1):
+    self.http = http
+    self.slots = concurrency
+    self.reserve = reserve
+    self.waiting = []
+    self.sequence = itertools.count()
+    self.stats = {}
+    self.greenlet = None
+
+  # Runs the requests made inside the block at housekeeping priority
+  @staticmethod
+  @contextlib.contextmanager
+  def housekeeping():
+    previous = getattr(_context, 'priority', pokerest.USER)
+    _context.priority = pokerest.HOUSEKEEPING
+    try:
+      yield
+    finally:
+      _context.priority = previous
+
+  @staticmethod
+  def currentPriority():
+    return getattr(_context, 'priority', pokerest.USER)
+
+  # The same bucket disco's rate limiter uses: method plus URL with only the
+  # guild and channel filled in
+  @staticmethod
+  def bucket(route, args):
+    filtered = dict((k, (v if k in ('guild', 'channel') else '')) for k, v in (args or {}).items())
+    return (route[0].value, route[1].format(**filtered))
+
+  def __call__(self, route, args=None, **kwargs):
+    return self.call(route, args, **kwargs)
+
+  def call(self, route, args=None, **kwargs):
+    priority = self.currentPriority()
+    bucket = self.bucket(route, args)
+    key = (route[0].value, route[1])
+    stats = self.stats.get(key)
+    if stats is None:
+      stats = self.stats[key] = routeStats()
+
+    start = time.time()
+    self.acquire(priority, bucket)
+    try:
+      sent = time.time()
+      stats.waited += sent - start
+      stats.calls += 1
+      if priority != self.USER:
+        stats.housekeeping += 1
+      try:
+        return self.http.call(route, args, **kwargs)
+      except Exception:
+        stats.errors += 1
+        raise
+      finally:
+        stats.latency.record(time.time() - sent)
+    finally:
+      self.release()
+
+  # Takes a slot.  Housekeeping waits for its bucket's budget without holding
+  # one, and if the budget ran out while it queued, gives the slot back and
+  # waits again, so sleeping housekeeping never holds up user requests.
+  def acquire(self, priority, bucket=None):
+    while True:
+      if priority != self.USER:
+        self.waitForBudget(bucket)
+      if self.slots > 0 and not self.waiting:
+        self.slots -= 1
+      else:
+        event = gevent.event.Event()
+        heapq.heappush(self.waiting, (priority, next(self.sequence), event))
+        # release() hands its slot straight to us
+        event.wait()
+      if priority == self.USER or self.budgetDelay(bucket) <= 0:
+        return
+      self.release()
+
+  def release(self):
+    if self.waiting:
+      (_, _, event) = heapq.heappop(self.waiting)
+      event.set()
+    else:
+      self.slots += 1
+
+  # How long until housekeeping may use the bucket again, or 0 if it can now
+  def budgetDelay(self, bucket):
+    state = self.http.limiter.states.get(bucket)
+    if state is None:
+      return 0
+    delay = state.reset_time - time.time()
+    if state.remaining <= self.reserve and delay > 0:
+      return delay
+    return 0
+
+  def waitForBudget(self, bucket):
+    delay = self.budgetDelay(bucket)
+    if delay > 0:
+      gevent.sleep(delay + .5)
+
+  # Anything else (e.g. the limiter) is passed through to the HTTPClient
+  def __getattr__(self, name):
+    return getattr(self.http, name)
+
+  def render(self):
+    lines = []
+    for name, attr in (('calls', 'calls'), ('errors', 'errors'), ('housekeeping_calls', 'housekeeping')):
+      lines.append('# TYPE exraidbot_discord_%s_total counter' % name)
+      for (method, url), stats in sorted(self.stats.items()):
+        lines.append('exraidbot_discord_%s_total{method="%s",route="%s"} %d' % (name, method, url, getattr(stats, attr)))
+    lines.append('# TYPE exraidbot_discord_queue_seconds_total counter')
+    for (method, url), stats in sorted(self.stats.items()):
+      lines.append('exraidbot_discord_queue_seconds_total{method="%s",route="%s"} %f' % (method, url, stats.waited))
+    lines.append('# TYPE exraidbot_discord_latency_seconds histogram')
+    for (method, url), stats in sorted(self.stats.items()):
+      lines += stats.latency.render('exraidbot_discord_latency_seconds', 'method="%s",route="%s"' % (method, url))
+    return '\n'.join(lines) + '\n'
+
+  # Periodically writes render() to a file, e.g. for node_exporter's textfile
+  # collector
+  def start(self, filename, interval=60):
+    if filename and self.greenlet is None:
+      self.greenlet = gevent.spawn(self.writeMetrics, filename, interval)
+
+  def stop(self):
+    if self.greenlet is not None:
+      self.greenlet.kill()
+      self.greenlet = None
+
+  def writeMetrics(self, filename, interval):
+    while True:
+      try:
+        writeAtomically(filename, self.render())
+      except Exception:
+        traceback.print_exc()
+      gevent.sleep(interval)
@@ -0,0 +1,118 @@
+import gevent
+import json
+import os
+import traceback
+
+from disco.types.channel import PermissionOverwriteType
+from pokerest import pokerest
+from pokeutil import writeAtomically
+
+# Maintains the pinned "users in this channel" message in each raid channel.
+#
+# The id of each channel's roster message is remembered (and persisted in the
+# pokestate or file, if one is given), so updating it is a single edit
+# instead of fetching every pin first.  Joins that arrive within `window` seconds of each other
+# are folded into one edit.  The roster is rebuilt from the channel's member
+# permission overwrites, which is who's actually in the channel, so
+# concurrent joins can't overwrite each other's names.
+class pokeroster:
+  def __init__(self, header, filename=None, window=2.0, state=None):
+    self.header = header
+    self.filename = filename
+    self.window = window
+    self.state = state
+    self.messageIds = {}
+    # channel id -> ordered list of user ids on the roster
+    self.members = {}
+    self.pending = {}
+    if state is not None:
+      self.messageIds = state.rosterMessageIds()
+    elif filename and os.path.exists(filename):
+      try:
+        with open(filename, 'r') as fp:
+          self.messageIds = {int(k): v for k, v in json.load(fp).iteritems()}
+      except ValueError:
+        # Corrupt file, we'll find the pins again as needed
+        self.messageIds = {}
+
+  # Called after posting a new channel's roster message
+  def remember(self, channel_id, message_id):
+    self.messageIds[channel_id] = message_id
+    self.members[channel_id] = []
+    self.save(channel_id)
+
+  def forget(self, channel_id):
+    self.members.pop(channel_id, None)
+    self.pending.pop(channel_id, None)
+    if self.messageIds.pop(channel_id, None) is not None:
+      self.save(channel_id)
+
+  # Adds a user to the roster.  The edit happens a moment later, along with
+  # anyone else who joins in the meantime.
+  def add(self, channel, user_id):
+    if channel.id in self.pending:
+      self.pending[channel.id][1].append(user_id)
+    else:
+      self.pending[channel.id] = (channel, [user_id])
+      gevent.spawn_later(self.window, self.flush, channel.id)
+
+  def flush(self, channel_id):
+    entry = self.pending.pop(channel_id, None)
+    if entry is None:
+      return
+    (channel, users) = entry
+    try:
+      members = self.currentMembers(channel)
+      for user_id in users:
+        if user_id not in members:
+          members.append(user_id)
+      with pokerest.housekeeping():
+        self.write(channel, self.render(members))
+    except Exception:
+      traceback.print_exc()
+
+  # Everyone who should be on the roster: whoever we've put there before,
+  # plus anyone with a member overwrite on the channel
+  def currentMembers(self, channel):
+    members = self.members.setdefault(channel.id, [])
+    for overwrite in channel.overwrites.values():
+      if overwrite.type == PermissionOverwriteType.MEMBER and overwrite.id not in members:
+        members.append(overwrite.id)
+    return members
+
+  def render(self, members):
+    return self.header + ''.join([' <@' + str(user_id) + '>' for user_id in members])
+
+  def write(self, channel, content):
+    message_id = self.messageIds.get(channel.id)
+    if message_id is not None:
+      try:
+        channel.client.api.channels_messages_modify(channel.id, message_id, content=content)
+        return
+      except Exception:
+        # The message was probably deleted or unpinned.  Go find it again.
+        traceback.print_exc()
+
+    message = self.findPin(channel)
+    if message is None:
+      message = channel.send_message(content)
+      message.pin()
+    else:
+      message.edit(content)
+    self.messageIds[channel.id] = message.id
+    self.save(channel.id)
+
+  def findPin(self, channel):
+    for pin in channel.get_pins():
+      if pin.content.startswith(self.header):
+        return pin
+    return None
+
+  def save(self, channel_id):
+    if self.state is not None:
+      self.state.setRosterMessageId(channel_id, self.messageIds.get(channel_id))
+      return
+    if not self.filename:
+      return
+    ids = dict(self.messageIds)
+    writeAtomically(self.filename, json.dumps(ids))
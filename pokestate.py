@@ -0,0 +1,161 @@
+import sqlite3
+import time
+
+from disco.types.channel import PermissionOverwriteType
+from pokeindex import guildIndex
+from pokeocr import exRaidData
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS channels (
+  id INTEGER PRIMARY KEY,
+  guild_id INTEGER NOT NULL,
+  name TEXT NOT NULL,
+  parent_id INTEGER,
+  roster_message_id INTEGER
+);
+CREATE INDEX IF NOT EXISTS channels_by_guild ON channels (guild_id, name);
+
+CREATE TABLE IF NOT EXISTS raids (
+  channel_id INTEGER PRIMARY KEY,
+  month INTEGER NOT NULL,
+  day INTEGER NOT NULL,
+  begin_minutes INTEGER NOT NULL,
+  end_minutes INTEGER NOT NULL,
+  location TEXT NOT NULL,
+  city TEXT
+);
+
+CREATE TABLE IF NOT EXISTS members (
+  channel_id INTEGER NOT NULL,
+  user_id INTEGER NOT NULL,
+  joined REAL NOT NULL,
+  PRIMARY KEY (channel_id, user_id)
+);
+CREATE INDEX IF NOT EXISTS members_by_user ON members (user_id);
+'''
+
+# What we know about the raid channels: which exist, the raid each one is
+# for, who's in them and the id of each one's roster message.  It's kept in
+# SQLite (in memory, or in a file so it survives restarts), and each change
+# is a single transaction.
+#
+# The gateway's channel events keep it current: a raid channel's members are
+# whoever has a member permission overwrite on it.  When a guild is loaded,
+# its channels are reconciled with what was saved, so channels deleted or
+# joined while the bot was down are caught up in one pass.
+#
+# Everything runs in greenlets on the main thread, which is the only thread
+# sqlite3 lets use the connection.
+class pokestate:
+  def __init__(self, filename=None):
+    self.db = sqlite3.connect(filename or ':memory:')
+    if filename:
+      self.db.execute('PRAGMA journal_mode=WAL')
+      self.db.execute('PRAGMA synchronous=NORMAL')
+    self.db.executescript(SCHEMA)
+
+  def close(self):
+    self.db.close()
+
+  @staticmethod
+  def isRaidChannel(channel):
+    return guildIndex.channelDate(channel.name) is not None
+
+  @staticmethod
+  def overwriteMembers(channel):
+    return set([o.id for o in channel.overwrites.values() if o.type == PermissionOverwriteType.MEMBER])
+
+  # Records a channel and replaces its members with the ones Discord has.
+  # Members we already knew about keep their join time.  Must be called in a
+  # transaction.
+  def saveChannel(self, channel, now=None):
+    now = now or time.time()
+    self.db.execute('INSERT OR IGNORE INTO channels (id, guild_id, name) VALUES (?, ?, ?)',
+                    (channel.id, channel.guild_id, channel.name))
+    self.db.execute('UPDATE channels SET guild_id = ?, name = ?, parent_id = ? WHERE id = ?',
+                    (channel.guild_id, channel.name, channel.parent_id, channel.id))
+
+    members = self.overwriteMembers(channel)
+    known = set([row[0] for row in self.db.execute('SELECT user_id FROM members WHERE channel_id = ?', (channel.id,))])
+    self.db.executemany('DELETE FROM members WHERE channel_id = ? AND user_id = ?',
+                        [(channel.id, user_id) for user_id in known - members])
+    self.db.executemany('INSERT INTO members (channel_id, user_id, joined) VALUES (?, ?, ?)',
+                        [(channel.id, user_id, now) for user_id in sorted(members - known)])
+
+  def deleteChannel(self, channel_id):
+    self.db.execute('DELETE FROM members WHERE channel_id = ?', (channel_id,))
+    self.db.execute('DELETE FROM raids WHERE channel_id = ?', (channel_id,))
+    self.db.execute('DELETE FROM channels WHERE id = ?', (channel_id,))
+
+  # Event hooks
+
+  def channelChanged(self, channel, now=None):
+    with self.db:
+      if self.isRaidChannel(channel):
+        self.saveChannel(channel, now)
+      else:
+        # It might have been renamed to something that isn't a raid
+        self.deleteChannel(channel.id)
+
+  def channelDeleted(self, channel_id):
+    with self.db:
+      self.deleteChannel(channel_id)
+
+  def guildLoaded(self, guild, now=None):
+    with self.db:
+      channels = [c for c in guild.channels.values() if self.isRaidChannel(c)]
+      ids = set([c.id for c in channels])
+      for (channel_id,) in self.db.execute('SELECT id FROM channels WHERE guild_id = ?', (guild.id,)).fetchall():
+        if channel_id not in ids:
+          self.deleteChannel(channel_id)
+      for channel in channels:
+        self.saveChannel(channel, now)
+
+  # Changes we make
+
+  # Called once a raid's new channel has been created
+  def addRaid(self, channel, raidInfo, now=None):
+    with self.db:
+      self.saveChannel(channel, now)
+      self.db.execute('INSERT OR REPLACE INTO raids VALUES (?, ?, ?, ?, ?, ?, ?)',
+                      (channel.id, raidInfo.monthNumber, raidInfo.dayNumber, raidInfo.beginMinutes,
+                       raidInfo.endMinutes, raidInfo.location, getattr(raidInfo, 'city', None)))
+
+  def addMember(self, channel_id, user_id, now=None):
+    with self.db:
+      self.db.execute('INSERT OR IGNORE INTO members (channel_id, user_id, joined) VALUES (?, ?, ?)',
+                      (channel_id, user_id, now or time.time()))
+
+  def setRosterMessageId(self, channel_id, message_id):
+    with self.db:
+      self.db.execute('UPDATE channels SET roster_message_id = ? WHERE id = ?', (message_id, channel_id))
+
+  # Queries
+
+  def isMember(self, channel_id, user_id):
+    return self.db.execute('SELECT 1 FROM members WHERE channel_id = ? AND user_id = ?',
+                           (channel_id, user_id)).fetchone() is not None
+
+  # User ids, in the order they joined
+  def members(self, channel_id):
+    return [row[0] for row in self.db.execute(
+      'SELECT user_id FROM members WHERE channel_id = ? ORDER BY joined, user_id', (channel_id,))]
+
+  # Ids of the raid channels a user is in
+  def channelsForUser(self, user_id):
+    return [row[0] for row in self.db.execute('SELECT channel_id FROM members WHERE user_id = ?', (user_id,))]
+
+  # The raid a channel was created for, or None if we didn't create it
+  def raid(self, channel_id):
+    row = self.db.execute('SELECT month, day, begin_minutes, end_minutes, location, city FROM raids WHERE channel_id = ?',
+                          (channel_id,)).fetchone()
+    if row is None:
+      return None
+    raidInfo = exRaidData(monthNumber=row[0], dayNumber=row[1], beginMinutes=row[2], endMinutes=row[3], location=row[4])
+    if row[5] is not None:
+      raidInfo.city = row[5]
+    return raidInfo
+
+  # channel id -> roster message id, for every channel that has one
+  def rosterMessageIds(self):
+    return dict(self.db.execute('SELECT id, roster_message_id FROM channels WHERE roster_message_id IS NOT NULL'))
@@ -0,0 +1,124 @@
+import collections
+import contextlib
+import threading
+import time
+import traceback
+
+from pokeutil import histogram, writeAtomically
+
+# Records how long each stage of processing an invite takes, along with
+# anything else worth knowing about it (e.g. how confident the template match
+# was), and hands the lot to a sink once the invite is done.
+#
+# Stages can nest, e.g. "dateparse" is part of "parse", and a stage that runs
+# more than once (e.g. OCR of each line) is reported as the total.  A timer
+# without a sink still times everything, it just doesn't report it anywhere.
+class poketimer:
+  def __init__(self, sink=None):
+    self.sink = sink
+    self.start = time.time()
+    # stage -> seconds, in the order the stages first finished
+    self.stages = collections.OrderedDict()
+    self.info = collections.OrderedDict()
+
+  # Whether anyone will see the results.  Callers can use this to skip work
+  # that's only done for the timings.
+  def enabled(self):
+    return self.sink is not None
+
+  @contextlib.contextmanager
+  def stage(self, name):
+    start = time.time()
+    try:
+      yield
+    finally:
+      self.stages[name] = self.stages.get(name, 0) + time.time() - start
+
+  def note(self, **info):
+    self.info.update(info)
+
+  def elapsed(self):
+    return time.time() - self.start
+
+  # Sends the timings to the sink.  Anything passed in is noted first.
+  def emit(self, **info):
+    self.note(**info)
+    if self.sink is None:
+      return
+    try:
+      self.sink(self)
+    except Exception:
+      traceback.print_exc()
+
+  # Formats a noted value for printing
+  @staticmethod
+  def formatValue(value):
+    if isinstance(value, float):
+      return '%.3f' % value
+    if isinstance(value, (list, tuple)):
+      return ','.join([poketimer.formatValue(v) for v in value])
+    return str(value)
+
+
+# Sinks.  A sink is any callable that takes a finished poketimer.
+
+# Prints one line per invite
+def logSink(timer):
+  fields = ['%s=%.3f' % (name, seconds) for (name, seconds) in timer.stages.iteritems()]
+  fields.append('total=%.3f' % timer.elapsed())
+  fields += ['%s=%s' % (key, poketimer.formatValue(value)) for key, value in timer.info.iteritems()]
+  print 'timings ' + ' '.join(fields)
+
+
+# Histogram bucket bounds, in seconds
+STAGE_BOUNDS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Keeps a latency histogram per stage and a count per result, and writes them
+# to a file in the Prometheus text format, e.g. for node_exporter's textfile
+# collector.  The file is rewritten at most every `interval` seconds.
+class prometheusSink:
+  def __init__(self, filename, interval=60):
+    self.filename = filename
+    self.interval = interval
+    self.written = 0
+    self.lock = threading.Lock()
+    # stage -> histogram
+    self.histograms = collections.OrderedDict()
+    self.results = collections.Counter()
+
+  def __call__(self, timer):
+    with self.lock:
+      for (name, seconds) in timer.stages.items() + [('total', timer.elapsed())]:
+        if name not in self.histograms:
+          self.histograms[name] = histogram(STAGE_BOUNDS)
+        self.histograms[name].record(seconds)
+      self.results[timer.info.get('result', 'unknown')] += 1
+      if time.time() - self.written >= self.interval:
+        self.write()
+
+  def render(self):
+    lines = ['# TYPE exraidbot_stage_seconds histogram']
+    for name, stageHistogram in self.histograms.iteritems():
+      lines += stageHistogram.render('exraidbot_stage_seconds', 'stage="%s"' % name)
+    lines.append('# TYPE exraidbot_invites_total counter')
+    for result, count in sorted(self.results.items()):
+      lines.append('exraidbot_invites_total{result="%s"} %d' % (result, count))
+    return '\n'.join(lines) + '\n'
+
+  def write(self):
+    self.written = time.time()
+    writeAtomically(self.filename, self.render())
+
+
+# Returns the sink for the timing_sink config option, or None for no timings
+def createTimingSink(name, filename=None):
+  if name == 'log':
+    return logSink
+  if name == 'prometheus':
+    if not filename:
+      print 'Warning: timing_sink is prometheus but timing_file is not set, timings are disabled'
+      return None
+    return prometheusSink(filename)
+  if name:
+    print 'Warning: unknown timing_sink ' + str(name) + ', timings are disabled'
+  return None
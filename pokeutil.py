@@ -0,0 +1,42 @@
+import bisect
+import os
+import tempfile
+
+# Replaces a file's contents by writing a temporary file next to it and
+# renaming it over the original, so neither a crash nor a reader (e.g.
+# node_exporter) ever sees it half-written.  Each call gets its own temporary
+# file, so it's safe to write the same file from several threads at once.
+def writeAtomically(filename, data):
+  (fd, tmp) = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)))
+  try:
+    with os.fdopen(fd, 'w') as fp:
+      fp.write(data)
+    os.rename(tmp, filename)
+  except Exception:
+    os.unlink(tmp)
+    raise
+
+
+# A Prometheus histogram: counts of the values recorded in each bucket, and
+# their sum
+class histogram:
+  def __init__(self, bounds):
+    self.bounds = bounds
+    self.counts = [0] * (len(bounds) + 1)
+    self.sum = 0.0
+
+  def record(self, value):
+    self.counts[bisect.bisect_left(self.bounds, value)] += 1
+    self.sum += value
+
+  # The histogram's lines in the Prometheus text format, without the TYPE
+  # line.  labels is the rendered label list, e.g. 'stage="ocr"'.
+  def render(self, name, labels):
+    lines = []
+    total = 0
+    for bound, count in zip(self.bounds + ('+Inf',), self.counts):
+      total += count
+      lines.append('%s_bucket{%s,le="%s"} %d' % (name, labels, bound, total))
+    lines.append('%s_sum{%s} %f' % (name, labels, self.sum))
+    lines.append('%s_count{%s} %d' % (name, labels, total))
+    return lines
@@ -0,0 +1,149 @@
+import sys
+
+from os.path import dirname
+sys.path.append(dirname(dirname(__file__)))
+
+from disco.types.channel import PermissionOverwriteType
+
+# Stand-ins for the parts of disco's channels, guilds and API client that the
+# bot uses.  Tests import them with "from conftest import ...".
+
+
+class FakeOverwrite(object):
+  def __init__(self, id, type=PermissionOverwriteType.MEMBER):
+    self.id = id
+    self.type = type
+
+
+class FakeRole(object):
+  def __init__(self, id, name):
+    self.id = id
+    self.name = name
+
+
+class FakeUser(object):
+  def __init__(self, id):
+    self.id = id
+
+
+class FakeMessage(object):
+  def __init__(self, channel, id, content, author=None):
+    self.channel = channel
+    self.id = id
+    self.content = content
+    self.author = author
+    self.pinned = False
+
+  def pin(self):
+    self.channel.calls.append('pin')
+    self.pinned = True
+
+  def edit(self, content):
+    self.channel.calls.append('edit')
+    self.content = content
+
+  def reply(self, content):
+    return self.channel.send_message(content)
+
+
+# Records the REST calls that would have been made to Discord.  Roster edits
+# go through the API with a channel id, so they're recorded on the channel
+# the client belongs to.
+class FakeAPI(object):
+  def __init__(self, channel=None):
+    self.channel = channel
+    self.calls = []
+
+  def http(self, route, args=None, **kwargs):
+    self.calls.append((route, args, kwargs))
+
+  def channels_messages_modify(self, channel, message, content=None):
+    self.channel.calls.append('modify')
+    self.channel.messages[message].content = content
+
+
+class FakeClient(object):
+  def __init__(self, channel=None):
+    self.api = FakeAPI(channel)
+
+
+# A channel that records the REST calls made on it.  Its members are the
+# users with a member overwrite, as in a raid channel, and like one it also
+# has a role overwrite.
+class FakeChannel(object):
+  def __init__(self, id, name='', members=(), parent_id=None, guild_id=1, position=0):
+    self.id = id
+    self.name = name
+    self.parent_id = parent_id
+    self.guild_id = guild_id
+    self.guild = None
+    self.position = position
+    self.overwrites = {2: FakeOverwrite(2, PermissionOverwriteType.ROLE)}
+    self.messages = {}
+    self.calls = []
+    self.deleted = False
+    self.client = FakeClient(self)
+    for user_id in members:
+      self.join(user_id)
+
+  def join(self, user_id):
+    self.overwrites[user_id] = FakeOverwrite(user_id)
+
+  def leave(self, user_id):
+    del self.overwrites[user_id]
+
+  def create_overwrite(self, user, allow=None):
+    self.calls.append('create_overwrite')
+    self.join(user.id)
+
+  def create_text_channel(self, name, permission_overwrites=()):
+    position = len([c for c in self.guild.channels.values() + self.guild.created if c.parent_id == self.id])
+    channel = self.guild.create(FakeChannel(self.guild.nextId(), name, parent_id=self.id, position=position))
+    channel.overwrites = {o.id: o for o in permission_overwrites}
+    return channel
+
+  def send_message(self, content):
+    self.calls.append('send')
+    message = FakeMessage(self, len(self.messages) + 100, content)
+    self.messages[message.id] = message
+    return message
+
+  def get_pins(self):
+    self.calls.append('get_pins')
+    return [m for m in self.messages.values() if m.pinned]
+
+  def set_position(self, position):
+    raise AssertionError('channels should be moved in bulk')
+
+  def delete(self):
+    self.deleted = True
+
+
+# Like disco's, a guild's channels only include the ones the bot creates once
+# the gateway's ChannelCreate has arrived, which tests do with add()
+class FakeGuild(object):
+  def __init__(self, channels=(), roles=(), id=1):
+    self.id = id
+    self.channels = {}
+    self.created = []
+    self.roles = {r.id: r for r in roles}
+    for channel in channels:
+      self.add(channel)
+
+  def add(self, channel):
+    channel.guild = self
+    self.channels[channel.id] = channel
+    return channel
+
+  def nextId(self):
+    return max([1000] + self.channels.keys() + [c.id for c in self.created]) + 1
+
+  # A channel made through the API, which the gateway hasn't told us about
+  def create(self, channel):
+    channel.guild = self
+    channel.guild_id = self.id
+    self.created.append(channel)
+    return channel
+
+  def create_category(self, name):
+    return self.create(FakeChannel(self.nextId(), name))
@@ -0,0 +1,40 @@
+import pytest
+import sys
+
+from os.path import dirname
+sys.path.append(dirname(dirname(__file__)))
+
+from conftest import FakeChannel, FakeClient
+from disco.api.http import Routes
+from pokediscord import pokediscord
+
+
+def test_sorted_channels_make_no_calls():
+  client = FakeClient()
+  channels = [FakeChannel(1, 'a', position=0), FakeChannel(2, 'b', position=1), FakeChannel(3, 'c', position=2)]
+  assert pokediscord.reorderChannels(client, 100, channels) == 0
+  assert client.api.calls == []
+
+
+def test_new_channel_moves_only_what_changed():
+  client = FakeClient()
+  # 'b' was just created at the end of the category
+  channels = [FakeChannel(1, 'a', position=0), FakeChannel(4, 'b', position=3), FakeChannel(2, 'c', position=1), FakeChannel(3, 'd', position=2)]
+  assert pokediscord.reorderChannels(client, 100, channels) == 3
+  assert len(client.api.calls) == 1
+
+  (route, args, kwargs) = client.api.calls[0]
+  assert route == Routes.GUILDS_CHANNELS_MODIFY
+  assert args == {'guild': 100}
+  assert kwargs['json'] == [
+    {'id': 4, 'position': 1},
+    {'id': 2, 'position': 2},
+    {'id': 3, 'position': 3},
+  ]
+
+
+def test_large_category_is_one_call():
+  client = FakeClient()
+  channels = [FakeChannel(i, 'c%02d' % i, position=39 - i) for i in range(40)]
+  assert pokediscord.reorderChannels(client, 100, channels) == 40
+  assert len(client.api.calls) == 1
@@ -0,0 +1,55 @@
+# This Python file uses the following encoding: utf-8
+import pytest
+import sys
+
+from os.path import dirname
+sys.path.append(dirname(dirname(__file__)))
+
+from pokeocr import normalize_datetime_line, parse_datetime_line, parse_datetime_line_with_dateparser, InvalidDateTimeException
+
+LINES = (
+  ('September 2 11:00AM - 11:45AM', 'September 2 11:00 AM - 11:45 AM'),
+  ('September 2 11:00 AM - 11:45 AM', 'September 2 11:00 AM - 11:45 AM'),
+  ('9 September 17:00 - 17:45', 'September 9 5:00 PM - 5:45 PM'),
+  ('September 12 12:00 AM - 12:45 AM', 'September 12 12:00 AM - 12:45 AM'),
+  ('June 5 12:00 PM - 12:45 PM', 'June 5 12:00 PM - 12:45 PM'),
+  (u'September 2 11:00 AM — 11:45 AM', 'September 2 11:00 AM - 11:45 AM'),
+  ('Sept 2 11:00 AM - 11:45 AM', 'September 2 11:00 AM - 11:45 AM'),
+)
+
+# Lines with misread digits or spacing that dateparser couldn't read
+OCR_LINES = (
+  ('September S 1:00 PM - 1:4S PM', 'September 5 1:00 PM - 1:45 PM'),
+  ('September 2 1Z:00 PM - 12:45 PM', 'September 2 12:00 PM - 12:45 PM'),
+  ('September 1l 1O:00 AM - 10:45 AM', 'September 11 10:00 AM - 10:45 AM'),
+  ('September 2 11:00AM-11:45AM', 'September 2 11:00 AM - 11:45 AM'),
+  ('SeptemberZ 11:00 AM - 11:45 AM', 'September 2 11:00 AM - 11:45 AM'),
+)
+
+
+@pytest.mark.parametrize('line, expected', LINES + OCR_LINES)
+def test_normalize(line, expected):
+  assert normalize_datetime_line(line) == expected
+
+
+def test_minutes():
+  assert parse_datetime_line('9 September 17:00 - 17:45') == (9, 9, 17 * 60, 17 * 60 + 45)
+  assert parse_datetime_line('September 2 12:30 AM - 1:15 AM') == (9, 2, 30, 75)
+
+
+@pytest.mark.parametrize('line', ['Blair Park', 'Smarch 2 11:00 AM - 11:45 AM', 'September 2 25:00 - 25:45', 'September 40 11:00 AM - 11:45 AM'])
+def test_unparseable(line):
+  assert parse_datetime_line(line) is None
+
+
+def test_unparseable_raises():
+  with pytest.raises(InvalidDateTimeException):
+    normalize_datetime_line('Blair Park')
+  with pytest.raises(InvalidDateTimeException):
+    normalize_datetime_line(None)
+
+
+@pytest.mark.parametrize('line, expected', LINES)
+def test_agrees_with_dateparser(line, expected):
+  pytest.importorskip('dateparser')
+  assert parse_datetime_line(line) == parse_datetime_line_with_dateparser(line)
@@ -0,0 +1,105 @@
+import pytest
+import sys
+import os
+import threading
+import BaseHTTPServer
+import SocketServer
+
+from os.path import dirname
+sys.path.append(dirname(dirname(__file__)))
+
+from cv2utils import imageDownloader, ImageTooLargeException, NotAnImageException
+
+TEST_IMAGE = os.path.abspath(os.path.join(dirname(__file__), '..', 'bottom.png'))
+
+
+class ThreadingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  daemon_threads = True
+
+
+# Stands in for the Discord CDN.  Serves the paths in ROUTES and counts the
+# connections it accepts, so tests can check that they're reused.
+class FakeCDNHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  protocol_version = 'HTTP/1.1'
+  connections = 0
+
+  def setup(self):
+    FakeCDNHandler.connections += 1
+    BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+
+  def do_GET(self):
+    (ctype, body, send_length) = self.server.routes[self.path]
+    self.send_response(200)
+    self.send_header('Content-Type', ctype)
+    if send_length:
+      self.send_header('Content-Length', str(len(body)))
+    else:
+      self.send_header('Connection', 'close')
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, *args):
+    pass
+
+
+@pytest.fixture
+def cdn():
+  with open(TEST_IMAGE, 'rb') as fp:
+    png = fp.read()
+
+  server = ThreadingHTTPServer(('127.0.0.1', 0), FakeCDNHandler)
+  server.routes = {
+    '/invite.png': ('image/png', png, True),
+    '/huge.png': ('image/png', png * 100, True),
+    '/huge-no-length.png': ('image/png', png * 100, False),
+    '/page.html': ('text/html', '<html></html>', True),
+    '/garbage.png': ('image/png', 'not really a png', True),
+  }
+  FakeCDNHandler.connections = 0
+  thread = threading.Thread(target=server.serve_forever)
+  thread.daemon = True
+  thread.start()
+
+  yield ('http://127.0.0.1:%d' % server.server_address[1], len(png))
+
+  server.shutdown()
+  server.server_close()
+
+
+def test_fetch_decodes_image(cdn):
+  (base, size) = cdn
+  image = imageDownloader().fetch(base + '/invite.png')
+  assert image is not None
+  assert len(image.shape) == 3
+
+
+def test_fetch_reuses_connection(cdn):
+  (base, size) = cdn
+  downloader = imageDownloader()
+  for i in range(3):
+    downloader.fetch(base + '/invite.png')
+  assert FakeCDNHandler.connections == 1
+
+
+def test_rejects_large_content_length(cdn):
+  (base, size) = cdn
+  with pytest.raises(ImageTooLargeException):
+    imageDownloader(max_bytes=size * 10).fetchBytes(base + '/huge.png')
+
+
+def test_rejects_large_body_without_content_length(cdn):
+  (base, size) = cdn
+  with pytest.raises(ImageTooLargeException):
+    imageDownloader(max_bytes=size * 10, chunk_size=1024).fetchBytes(base + '/huge-no-length.png')
+
+
+def test_rejects_non_image_content_type(cdn):
+  (base, size) = cdn
+  with pytest.raises(NotAnImageException):
+    imageDownloader().fetchBytes(base + '/page.html')
+
+
+def test_rejects_undecodable_image(cdn):
+  (base, size) = cdn
+  with pytest.raises(NotAnImageException):
+    imageDownloader().fetch(base + '/garbage.png')
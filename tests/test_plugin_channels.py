@@ -0,0 +1,126 @@
+import pytest
+import sys
+import json
+import gevent
+
+from os.path import dirname
+sys.path.append(dirname(dirname(__file__)))
+
+from conftest import FakeChannel, FakeClient, FakeGuild, FakeMessage, FakeRole, FakeUser
+from disco.api.http import Routes
+from plugins.exraidplugin import ExRaidPlugin
+from pokeindex import pokeindex
+from pokeocr import exRaidData
+from pokepipeline import pokepipeline
+from pokepurger import pokepurger
+from pokeroster import pokeroster
+from pokestate import pokestate
+
+MESSAGES = json.load(open(dirname(dirname(__file__)) + '/config/exraid.default.json'))['messages']
+CATEGORY = 'ex_raids_9-9'
+CHANNEL = '9-9_ex_u_blair_park'
+
+
+class config(object):
+  roles_for_new_channels = ['admin', 'mod']
+  messages = MESSAGES
+
+
+class FakeEvent(object):
+  def __init__(self, guild):
+    self.guild = guild
+
+
+@pytest.fixture
+def plugin():
+  plugin = ExRaidPlugin.__new__(ExRaidPlugin)
+  plugin.config = config()
+  plugin.client = FakeClient()
+  plugin.pipeline = pokepipeline(1)
+  plugin.index = pokeindex()
+  plugin.state = pokestate()
+  plugin.purger = pokepurger(3, jitter=0)
+  plugin.roster = pokeroster(MESSAGES['users_in_channel_message'], window=0.01)
+  return plugin
+
+
+@pytest.fixture
+def guild():
+  return FakeGuild([
+    FakeChannel(10, CATEGORY),
+    FakeChannel(11, '9-9_ex_u_zoo', parent_id=10),
+    FakeChannel(12, 'exclusive_raid_meetups'),
+  ], [
+    FakeRole(1, '@everyone'),
+    FakeRole(3, 'mod'),
+  ])
+
+
+def raid():
+  return exRaidData(month='September', day='9', begin='4:30PM', end='5:15PM', location='Blair Park', city='Urbana')
+
+
+def invite(guild, user_id):
+  return FakeMessage(guild.channels[12], 1, '', author=FakeUser(user_id))
+
+
+def test_new_raid_creates_channel_and_joins(plugin, guild):
+  plugin.addToRaidChannel(FakeEvent(guild), invite(guild, 100), CATEGORY, CHANNEL, raid())
+  gevent.sleep(0.05)
+
+  channel = plugin.getChannelByName(CHANNEL, guild)
+  assert channel.parent_id == 10
+  # Hidden from @everyone, shown to mods (there's no admin role) and the user
+  assert sorted(channel.overwrites.keys()) == [1, 3, 100]
+  assert plugin.state.raid(channel.id) == raid()
+  assert plugin.state.members(channel.id) == [100]
+  assert len(plugin.purger) == 1
+
+  # The new channel goes before the zoo, in one request
+  assert len(plugin.client.api.calls) == 1
+  (route, args, kwargs) = plugin.client.api.calls[0]
+  assert route == Routes.GUILDS_CHANNELS_MODIFY
+  assert kwargs['json'] == [{'id': channel.id, 'position': 0}, {'id': 11, 'position': 1}]
+
+  replies = [m.content for m in guild.channels[12].messages.values()]
+  assert replies == ['<@100> ' + MESSAGES['added_success'] + ' <#%d>' % channel.id]
+  pin = [m for m in channel.messages.values() if m.pinned][0]
+  assert pin.content == MESSAGES['users_in_channel_message'] + ' <@100>'
+
+
+# The next invites arrive before the gateway tells us about the new channel
+def test_existing_raid_is_joined(plugin, guild):
+  plugin.addToRaidChannel(FakeEvent(guild), invite(guild, 100), CATEGORY, CHANNEL, raid())
+  channel = plugin.getChannelByName(CHANNEL, guild)
+  plugin.addToRaidChannel(FakeEvent(guild), invite(guild, 101), CATEGORY, CHANNEL, raid())
+  plugin.addToRaidChannel(FakeEvent(guild), invite(guild, 100), CATEGORY, CHANNEL, raid())
+  gevent.sleep(0.05)
+
+  assert guild.created == [channel]
+  assert plugin.state.members(channel.id) == [100, 101]
+  assert channel.calls.count('create_overwrite') == 2
+  replies = [m.content for m in sorted(guild.channels[12].messages.values(), key=lambda m: m.id)]
+  assert replies[-1] == '<@100> ' + MESSAGES['user_already_in_channel'] + ' <#%d>' % channel.id
+  pin = [m for m in channel.messages.values() if m.pinned][0]
+  assert pin.content == MESSAGES['users_in_channel_message'] + ' <@100> <@101>'
+
+
+def test_new_category(plugin, guild):
+  plugin.addToRaidChannel(FakeEvent(guild), invite(guild, 100), 'ex_raids_9-10', '9-10_ex_u_blair_park', raid())
+  plugin.addToRaidChannel(FakeEvent(guild), invite(guild, 101), 'ex_raids_9-10', '9-10_ex_u_fred_b_lamb_trail', raid())
+  category = plugin.getChannelByName('ex_raids_9-10', guild)
+  channels = [plugin.getChannelByName(name, guild) for name in ('9-10_ex_u_blair_park', '9-10_ex_u_fred_b_lamb_trail')]
+  assert guild.created == [category] + channels
+  assert [c.parent_id for c in channels] == [category.id] * 2
+  assert [plugin.state.members(c.id) for c in channels] == [[100], [101]]
+
+
+def test_gateway_catches_up(plugin, guild):
+  plugin.addToRaidChannel(FakeEvent(guild), invite(guild, 100), CATEGORY, CHANNEL, raid())
+  created = plugin.getChannelByName(CHANNEL, guild)
+
+  # The gateway's ChannelCreate has its own object for the channel
+  channel = guild.add(FakeChannel(created.id, CHANNEL, members=[100], parent_id=10))
+  plugin.channelChanged(channel)
+  assert plugin.getChannelByName(CHANNEL, guild) is channel
+  assert sorted(c.id for c in plugin.index.forGuild(guild).children(10)) == [11, created.id]
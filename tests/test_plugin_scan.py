@@ -0,0 +1,92 @@
+import pytest
+import sys
+import os
+import stat
+import subprocess
+
+from os.path import dirname, abspath
+
+ROOT = dirname(dirname(abspath(__file__)))
+INVITE = os.path.join(ROOT, 'test_images', 'Champaign_IL', 'Blair-Park', '20180902_Invite001.png')
+
+# Stands in for tesseract.  pyocr asks it for its version and languages, and
+# for OCR writes the text to the output file it's given.
+TESSERACT = '''#!/bin/sh
+case "$1" in
+  -v|--version) echo "tesseract 3.05.01";;
+  --list-langs) echo "List of available languages (1):"; echo "eng";;
+  *) printf 'September 9 4:30 PM - 5:15 PM\\nBlair Park\\nSan Francisco, CA, United States\\nGet directions\\n' > "$2.txt";;
+esac
+'''
+
+# Runs in its own process, patched the way disco patches the bot's
+SETUP = '''
+from gevent import monkey
+monkey.patch_all()
+import sys
+sys.path.insert(0, %(root)r)
+import json
+from plugins.exraidplugin import ExRaidPlugin
+from pokecache import pokecache
+from pokeocr import pokeocr
+from pokepipeline import pokepipeline
+from poketimer import poketimer
+from cv2utils import scalingTemplate
+
+CONFIG = json.load(open('config/exraid.json'))
+
+class config(object):
+  include_city_in_channel_names = True
+  location_regular_expression = CONFIG['location_regular_expression']
+  top_left_image = 'topleft.png'
+  bottom_image = 'bottom.png'
+
+class downloader(object):
+  def fetchBytes(self, url):
+    return open(url, 'rb').read()
+
+plugin = ExRaidPlugin.__new__(ExRaidPlugin)
+plugin.config = config()
+plugin.pipeline = pokepipeline(2)
+plugin.downloader = downloader()
+plugin.results = pokecache()
+plugin.warming = None
+
+def show(raidInfo):
+  print json.dumps([raidInfo.location, raidInfo.city, raidInfo.month, raidInfo.day, raidInfo.begin])
+'''
+
+SCAN = SETUP + '''
+plugin.topleft = scalingTemplate.fromFile('topleft.png')
+plugin.bottom = scalingTemplate.fromFile('bottom.png')
+plugin.ocr = pokeocr(CONFIG['location_regular_expression'])
+
+timer = poketimer()
+image = plugin.pipeline.scan(plugin.cropAttachment, open(%(invite)r, 'rb').read(), timer)
+show(plugin.scanCroppedImage(image, timer))
+'''
+
+# From connecting to the gateway to the first scan
+WARMUP = SETUP + '''
+plugin.on_ready(None)
+show(plugin.scanAttachment(%(invite)r))
+'''
+
+EXPECTED = '["Blair Park", "San Francisco", "September", "9", "4:30PM"]'
+
+
+def run(tmpdir, script):
+  tesseract = tmpdir.join('tesseract')
+  tesseract.write(TESSERACT)
+  os.chmod(str(tesseract), stat.S_IRWXU)
+  env = dict(os.environ, PATH=str(tmpdir) + os.pathsep + os.environ['PATH'])
+  return subprocess.check_output([sys.executable, '-W', 'ignore', '-c', script % {'root': ROOT, 'invite': INVITE}],
+                                 cwd=ROOT, env=env, stderr=subprocess.STDOUT)
+
+
+def test_scan_through_pipeline_under_gevent(tmpdir):
+  assert run(tmpdir, SCAN).splitlines()[-1] == EXPECTED
+
+
+def test_warmup_then_scan_under_gevent(tmpdir):
+  assert run(tmpdir, WARMUP).splitlines()[-1] == EXPECTED
@@ -0,0 +1,105 @@
+import pytest
+import sys
+import os
+import datetime
+import json
+import time
+
+from os.path import dirname
+sys.path.append(dirname(dirname(__file__)))
+
+from pokecache import pokecache
+from pokeocr import exRaidData
+
+
+def raid(month='September', day='9', location='Champaign Waterfall'):
+  return exRaidData(month=month, day=day, begin='5:00PM', end='5:45PM', location=location, city='Champaign')
+
+
+def timestamp(*args):
+  return time.mktime(datetime.datetime(*args).timetuple())
+
+
+def test_get_returns_copy_of_result():
+  cache = pokecache()
+  cache.put(raid(), 'sha1:abc', 'sha1:def')
+  for key in ('sha1:abc', 'sha1:def'):
+    result = cache.get(key, now=timestamp(2018, 9, 1))
+    assert result.location == 'Champaign Waterfall'
+    assert result.day == '9'
+  assert cache.get('sha1:missing') is None
+
+
+def test_expires_day_after_raid():
+  info = raid()
+  expires = pokecache.expiryFor(info, datetime.datetime(2018, 9, 1, 12))
+  assert expires == timestamp(2018, 9, 11)
+
+  cache = pokecache()
+  cache.entries['k'] = (expires, info)
+  assert cache.get('k', now=timestamp(2018, 9, 10, 23, 59)) is not None
+  assert cache.get('k', now=timestamp(2018, 9, 11)) is None
+  assert len(cache) == 0
+
+
+def test_expiry_rolls_over_year():
+  expires = pokecache.expiryFor(raid(month='January', day='3'), datetime.datetime(2018, 12, 30))
+  assert expires == timestamp(2019, 1, 5)
+
+
+def test_expiry_of_dates_missing_this_year():
+  # A misread June 31 is taken as July 1
+  expires = pokecache.expiryFor(raid(month='June', day='31'), datetime.datetime(2018, 6, 20))
+  assert expires == timestamp(2018, 7, 3)
+  expires = pokecache.expiryFor(raid(month='February', day='29'), datetime.datetime(2019, 2, 20))
+  assert expires == timestamp(2019, 3, 3)
+
+
+def test_evicts_least_recently_used():
+  cache = pokecache(size=2)
+  cache.put(raid(location='A'), 'a')
+  cache.put(raid(location='B'), 'b')
+  cache.get('a', now=timestamp(2018, 9, 1))
+  cache.put(raid(location='C'), 'c')
+  assert cache.get('b', now=timestamp(2018, 9, 1)) is None
+  assert cache.get('a', now=timestamp(2018, 9, 1)).location == 'A'
+  assert cache.get('c', now=timestamp(2018, 9, 1)).location == 'C'
+
+
+def test_persists_to_file(tmpdir):
+  filename = str(tmpdir.join('results.json'))
+  tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+  cache = pokecache(filename=filename)
+  cache.put(raid(month=tomorrow.strftime('%B'), day=str(tomorrow.day)), 'sha1:abc')
+
+  reloaded = pokecache(filename=filename)
+  result = reloaded.get('sha1:abc')
+  assert result.location == 'Champaign Waterfall'
+
+
+def test_reads_results_saved_as_strings(tmpdir):
+  filename = str(tmpdir.join('results.json'))
+  tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+  data = {'month': tomorrow.strftime('%B'), 'day': str(tomorrow.day), 'begin': '5:00PM', 'end': '5:45PM',
+          'location': 'Champaign Waterfall', 'city': 'Champaign'}
+  with open(filename, 'w') as fp:
+    json.dump([['sha1:abc', [time.time() + 86400, data]]], fp)
+
+  result = pokecache(filename=filename).get('sha1:abc')
+  assert result.monthNumber == tomorrow.month
+  assert result.beginMinutes == 17 * 60
+  assert result.begin == '5:00PM'
+
+
+def test_cached_results_are_copies():
+  cache = pokecache()
+  info = raid()
+  cache.put(info, 'k')
+  info.location = 'Changed'
+  cache.get('k', now=timestamp(2018, 9, 1)).location = 'Also changed'
+  assert cache.get('k', now=timestamp(2018, 9, 1)).location == 'Champaign Waterfall'
+
+
+def test_content_key_is_stable():
+  assert pokecache.contentKey(bytearray('abc')) == pokecache.contentKey(bytearray('abc'))
+  assert pokecache.contentKey(bytearray('abc')) != pokecache.contentKey(bytearray('abd'))
@@ -0,0 +1,67 @@
+import pytest
+import sys
+import json
+import random
+import time
+
+from os.path import dirname
+sys.path.append(dirname(dirname(__file__)))
+
+from pokegyms import pokegyms, gymEntry
+
+GYMS = [
+  {'name': 'Fred B Lamb Trail', 'city': 'Champaign'},
+  {'name': 'Blair Park', 'city': 'Urbana'},
+  {'name': 'Blair Park', 'city': 'Champaign'},
+  {'name': 'Beckman Institute - Upwells Fountain', 'city': 'Urbana', 'aliases': ['Upwells Fountain']},
+  {'name': 'Boneyard Creek Second Street Basin', 'city': 'Champaign'},
+]
+
+
+@pytest.fixture
+def gyms(tmpdir):
+  filename = str(tmpdir.join('gyms.json'))
+  with open(filename, 'w') as fp:
+    json.dump(GYMS, fp)
+  return pokegyms.fromFile(filename)
+
+
+def test_exact_and_misread_names(gyms):
+  assert len(gyms) == 5
+  assert gyms.lookup('Fred B Lamb Trail')[0].name == 'Fred B Lamb Trail'
+  assert gyms.lookup('Fred 8 Lamb Trai1')[0].name == 'Fred B Lamb Trail'
+  assert gyms.lookup(u'Boneyard Creek Second Street  8asin')[0].name == 'Boneyard Creek Second Street Basin'
+  assert gyms.lookup('Beckman lnstitute - Upwells Fountain')[0].name == 'Beckman Institute - Upwells Fountain'
+
+
+def test_alias(gyms):
+  (gym, score) = gyms.lookup('Upwells Fountain')
+  assert gym.name == 'Beckman Institute - Upwells Fountain'
+  assert score == 100
+
+
+def test_unknown_gym(gyms):
+  assert gyms.lookup('Stern Grove Entrance') is None
+  assert gyms.lookup('') is None
+
+
+def test_prefers_same_city(gyms):
+  assert gyms.lookup('Blair Park', 'Champaign')[0].city == 'Champaign'
+  assert gyms.lookup('Blair Park', 'Urbana')[0].city == 'Urbana'
+  assert gyms.lookup('Blair Park', 'Chicago')[0].name == 'Blair Park'
+
+
+def test_lookup_is_fast_with_many_gyms():
+  random.seed(1)
+  words = ['park', 'trail', 'church', 'fountain', 'mural', 'statue', 'garden', 'memorial', 'library', 'plaza',
+           'creek', 'bridge', 'sign', 'playground', 'school', 'gazebo', 'pavilion', 'field', 'tower', 'art']
+  names = set()
+  while len(names) < 5000:
+    names.add(' '.join(random.sample(words, 3)).title())
+  gyms = pokegyms([gymEntry(name) for name in names])
+
+  queries = random.sample(sorted(names), 200)
+  start = time.time()
+  for name in queries:
+    assert gyms.lookup(name)[0].name == name
+  assert (time.time() - start) / len(queries) < 0.005
@@ -0,0 +1,131 @@
+import pytest
+import sys
+
+from os.path import dirname
+sys.path.append(dirname(dirname(__file__)))
+
+from conftest import FakeChannel, FakeGuild, FakeRole
+from pokeindex import pokeindex
+
+
+@pytest.fixture
+def guild():
+  return FakeGuild([
+    FakeChannel(10, 'ex_raids_9-9'),
+    FakeChannel(11, '9-9_ex_c_champaign_waterfall', parent_id=10),
+    FakeChannel(12, '9-9_ex_u_blair_park', parent_id=10),
+    FakeChannel(13, 'general'),
+  ], [
+    FakeRole(1, '@everyone'),
+    FakeRole(2, 'mod'),
+  ])
+
+
+def test_lookups(guild):
+  index = pokeindex().forGuild(guild)
+  assert index.channelByName('general').id == 13
+  assert index.channelByName('missing') is None
+  assert index.roleByName('mod').id == 2
+  assert sorted(c.id for c in index.children(10)) == [11, 12]
+
+
+def test_channel_events(guild):
+  indexes = pokeindex()
+  index = indexes.forGuild(guild)
+
+  created = FakeChannel(14, '9-9_ex_c_fred_b_lamb_trail', parent_id=10)
+  guild.channels[14] = created
+  indexes.channelChanged(created)
+  assert index.channelByName('9-9_ex_c_fred_b_lamb_trail') is created
+  assert 14 in [c.id for c in index.children(10)]
+
+  renamed = FakeChannel(13, 'chat')
+  guild.channels[13] = renamed
+  indexes.channelChanged(renamed)
+  assert index.channelByName('general') is None
+  assert index.channelByName('chat') is renamed
+
+  del guild.channels[12]
+  indexes.channelDeleted(FakeChannel(12, '9-9_ex_u_blair_park', parent_id=10))
+  assert index.channelByName('9-9_ex_u_blair_park') is None
+  assert sorted(c.id for c in index.children(10)) == [11, 14]
+
+
+def test_role_events(guild):
+  indexes = pokeindex()
+  index = indexes.forGuild(guild)
+
+  guild.roles[3] = FakeRole(3, 'admin')
+  indexes.roleChanged(guild.id, guild.roles[3])
+  assert index.roleByName('admin').id == 3
+
+  del guild.roles[2]
+  indexes.roleDeleted(guild.id, 2)
+  assert index.roleByName('mod') is None
+
+
+def test_created_channels_are_found_before_the_gateway_has_them(guild):
+  indexes = pokeindex()
+  index = indexes.forGuild(guild)
+
+  created = guild.create(FakeChannel(14, '9-9_ex_c_fred_b_lamb_trail', parent_id=10))
+  indexes.channelCreated(guild, created)
+  assert index.channelByName('9-9_ex_c_fred_b_lamb_trail') is created
+  assert index.channelByNameFuzzy('9-9_ex_c_fred_b_lamb_tra1l', 90)[0] is created
+  assert 14 in [c.id for c in index.children(10)]
+
+  channel = guild.add(FakeChannel(14, '9-9_ex_c_fred_b_lamb_trail', parent_id=10))
+  indexes.channelChanged(channel)
+  assert index.channelByName('9-9_ex_c_fred_b_lamb_trail') is channel
+  assert index.created == {}
+
+
+def test_reloaded_guild_is_reindexed(guild):
+  indexes = pokeindex()
+  indexes.forGuild(guild)
+
+  # After a reconnect, disco has a new object for the same guild, and only
+  # that one sees new channels
+  reloaded = FakeGuild(guild.channels.values(), guild.roles.values())
+  created = reloaded.add(FakeChannel(14, '9-9_ex_c_fred_b_lamb_trail', parent_id=10))
+  indexes.channelChanged(created)
+  index = indexes.forGuild(reloaded)
+  assert index.channelByName('9-9_ex_c_fred_b_lamb_trail') is created
+  assert sorted(c.id for c in index.children(10)) == [11, 12, 14]
+
+
+def test_events_for_unindexed_guild_are_ignored(guild):
+  indexes = pokeindex()
+  indexes.channelChanged(FakeChannel(20, 'elsewhere', guild_id=2))
+  indexes.roleDeleted(2, 5)
+  assert indexes.guilds == {}
+
+
+def test_fuzzy_channel_lookup(guild):
+  guild.channels[14] = FakeChannel(14, '9-10_ex_c_champaign_waterfall', parent_id=10)
+  guild.channels[15] = FakeChannel(15, '9-9_ex_c_starbucks_1630', parent_id=10)
+  index = pokeindex().forGuild(guild)
+
+  (channel, score) = index.channelByNameFuzzy('9-9_ex_c_champaign_waterfa1l', 95)
+  assert channel.id == 11 and 95 <= score < 100
+  assert index.channelByNameFuzzy('9-9_ex_c_champaign_waterfa1l', 99) is None
+  # Only channels for the same day, and at the same time, are candidates
+  assert index.channelByNameFuzzy('9-8_ex_c_champaign_waterfall', 90) is None
+  assert index.channelByNameFuzzy('9-9_ex_c_starbucks_1700', 80) is None
+  assert index.channelByNameFuzzy('9-9_ex_c_starbuck_1630', 80)[0].id == 15
+  assert index.channelByNameFuzzy('general', 50) is None
+
+
+def test_fuzzy_lookup_follows_channel_events(guild):
+  indexes = pokeindex()
+  index = indexes.forGuild(guild)
+
+  renamed = FakeChannel(12, '9-9_ex_u_blair_park_north', parent_id=10)
+  guild.channels[12] = renamed
+  indexes.channelChanged(renamed)
+  assert index.channelByNameFuzzy('9-9_ex_u_blair_park_n0rth', 90)[0] is renamed
+
+  del guild.channels[12]
+  indexes.channelDeleted(renamed)
+  assert index.channelByNameFuzzy('9-9_ex_u_blair_park_n0rth', 90) is None
+  assert index.dateIds == {'9-9_ex_': set([11])}
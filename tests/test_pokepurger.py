@@ -0,0 +1,77 @@
+import pytest
+import sys
+import datetime
+import time
+
+from os.path import dirname
+sys.path.append(dirname(dirname(__file__)))
+
+from conftest import FakeChannel, FakeGuild
+from pokediscord import pokediscord
+from pokepurger import pokepurger
+
+
+def timestamp(*args):
+  return time.mktime(datetime.datetime(*args).timetuple())
+
+
+NOW = datetime.datetime(2018, 9, 1, 12)
+
+
+def test_channel_expiry():
+  assert pokediscord.channelExpiry('9-2_ex_u_blair_park', 3, NOW) == timestamp(2018, 9, 5)
+  assert pokediscord.channelExpiry('ex_raids_9-2', 0, NOW) == timestamp(2018, 9, 2)
+  assert pokediscord.channelExpiry('general', 3, NOW) is None
+
+
+def test_due_in_expiry_order():
+  guild = FakeGuild([
+    FakeChannel(1, '9-9_ex_c_champaign_waterfall'),
+    FakeChannel(2, '9-2_ex_u_blair_park'),
+    FakeChannel(3, 'general'),
+    FakeChannel(4, 'ex_raids_9-2'),
+  ])
+  purger = pokepurger(3, jitter=0)
+  for channel in guild.channels.values():
+    purger.track(guild, channel, NOW)
+  assert len(purger) == 3
+
+  assert purger.due(timestamp(2018, 9, 4)) == []
+  assert purger.nextDue(timestamp(2018, 9, 4)) == 24 * 60 * 60
+  assert sorted(c for g, c in purger.due(timestamp(2018, 9, 5))) == [2, 4]
+  assert [c for g, c in purger.due(timestamp(2018, 9, 30))] == [1]
+  assert purger.nextDue() is None
+
+
+def test_untracked_and_renamed_channels_are_skipped():
+  guild = FakeGuild([FakeChannel(1, '9-2_ex_u_blair_park'), FakeChannel(2, '9-2_ex_c_champaign_waterfall')])
+  purger = pokepurger(0, jitter=0)
+  for channel in guild.channels.values():
+    purger.track(guild, channel, NOW)
+
+  purger.untrack(1)
+  guild.channels[2].name = '9-9_ex_c_champaign_waterfall'
+  purger.track(guild, guild.channels[2], NOW)
+
+  assert purger.due(timestamp(2018, 9, 3)) == []
+  assert [c for g, c in purger.due(timestamp(2018, 9, 10))] == [2]
+
+
+def test_disabled():
+  guild = FakeGuild([FakeChannel(1, '9-2_ex_u_blair_park')])
+  purger = pokepurger(-1)
+  purger.track(guild, guild.channels[1], NOW)
+  assert len(purger) == 0
+
+
+def test_purge_deletes_only_expired_channels():
+  yesterday = datetime.date.today() - datetime.timedelta(days=1)
+  tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+  old = FakeChannel(1, '%d-%d_ex_u_blair_park' % (yesterday.month, yesterday.day))
+  new = FakeChannel(2, '%d-%d_ex_u_blair_park' % (tomorrow.month, tomorrow.day))
+  guild = FakeGuild([old, new])
+  purger = pokepurger(0)
+  purger.purge(guild, 1)
+  purger.purge(guild, 2)
+  assert old.deleted
+  assert not new.deleted
@@ -0,0 +1,108 @@
+import pytest
+import sys
+import time
+import gevent
+
+from os.path import dirname
+sys.path.append(dirname(dirname(__file__)))
+
+from disco.api.http import Routes
+from pokerest import pokerest
+
+
+class FakeState(object):
+  def __init__(self, remaining, reset_time):
+    self.remaining = remaining
+    self.reset_time = reset_time
+
+
+class FakeLimiter(object):
+  def __init__(self):
+    self.states = {}
+
+
+# Stands in for disco's HTTPClient, recording the order requests are sent in
+class FakeHTTP(object):
+  def __init__(self, delay=0.01):
+    self.delay = delay
+    self.limiter = FakeLimiter()
+    self.sent = []
+
+  def call(self, route, args=None, **kwargs):
+    gevent.sleep(self.delay)
+    if kwargs.get('fail'):
+      raise ValueError('failed')
+    self.sent.append(kwargs.get('name'))
+    return kwargs.get('name')
+
+
+def test_user_requests_jump_the_queue():
+  http = FakeHTTP()
+  rest = pokerest(http, concurrency=1)
+
+  def housekeeping(name):
+    with pokerest.housekeeping():
+      rest(Routes.GUILDS_CHANNELS_MODIFY, dict(guild=1), name=name)
+
+  greenlets = [gevent.spawn(housekeeping, 'reorder%d' % i) for i in range(3)]
+  gevent.sleep(0)
+  greenlets.append(gevent.spawn(rest, Routes.CHANNELS_MESSAGES_CREATE, dict(channel=2), name='reply'))
+  gevent.joinall(greenlets)
+
+  # The first reorder was already in flight, the reply goes next
+  assert http.sent == ['reorder0', 'reply', 'reorder1', 'reorder2']
+
+
+def test_housekeeping_leaves_the_last_request_for_users():
+  http = FakeHTTP(delay=0)
+  rest = pokerest(http)
+  bucket = pokerest.bucket(Routes.CHANNELS_DELETE, dict(channel=2))
+  http.limiter.states[bucket] = FakeState(1, time.time() + 0.2)
+
+  start = time.time()
+  assert rest(Routes.CHANNELS_DELETE, dict(channel=2), name='user') == 'user'
+  assert time.time() - start < 0.1
+
+  with pokerest.housekeeping():
+    rest(Routes.CHANNELS_DELETE, dict(channel=2), name='purge')
+  assert time.time() - start >= 0.2
+
+
+def test_housekeeping_waits_for_budget_without_a_slot():
+  http = FakeHTTP(delay=0)
+  rest = pokerest(http, concurrency=1)
+  bucket = pokerest.bucket(Routes.CHANNELS_DELETE, dict(channel=2))
+  http.limiter.states[bucket] = FakeState(1, time.time() + 0.2)
+
+  def purge():
+    with pokerest.housekeeping():
+      rest(Routes.CHANNELS_DELETE, dict(channel=2), name='purge')
+
+  purger = gevent.spawn(purge)
+  gevent.sleep(0)
+  start = time.time()
+  assert rest(Routes.CHANNELS_MESSAGES_CREATE, dict(channel=3), name='reply') == 'reply'
+  assert time.time() - start < 0.1
+  purger.join()
+  assert http.sent == ['reply', 'purge']
+
+
+def test_metrics():
+  http = FakeHTTP(delay=0)
+  rest = pokerest(http)
+  rest(Routes.CHANNELS_MESSAGES_CREATE, dict(channel=2), name='reply')
+  rest(Routes.CHANNELS_MESSAGES_CREATE, dict(channel=2), name='reply')
+  with pytest.raises(ValueError):
+    rest(Routes.CHANNELS_MESSAGES_CREATE, dict(channel=3), fail=True)
+  with pokerest.housekeeping():
+    rest(Routes.GUILDS_CHANNELS_MODIFY, dict(guild=1), name='reorder')
+
+  stats = rest.stats[('POST', '/channels/{channel}/messages')]
+  assert (stats.calls, stats.errors, stats.housekeeping) == (3, 1, 0)
+  assert rest.stats[('PATCH', '/guilds/{guild}/channels')].housekeeping == 1
+
+  text = rest.render()
+  assert 'exraidbot_discord_calls_total{method="POST",route="/channels/{channel}/messages"} 3' in text
+  assert 'exraidbot_discord_latency_seconds_count{method="PATCH",route="/guilds/{guild}/channels"} 1' in text
+  # Everything else is still the HTTPClient's
+  assert rest.limiter is http.limiter
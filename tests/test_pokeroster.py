@@ -0,0 +1,68 @@
+import pytest
+import sys
+import gevent
+
+from os.path import dirname
+sys.path.append(dirname(dirname(__file__)))
+
+from conftest import FakeChannel
+from pokeroster import pokeroster
+
+HEADER = 'Users in this channel:'
+
+
+def test_burst_of_joins_is_one_edit():
+  channel = FakeChannel(5)
+  roster = pokeroster(HEADER, window=0.01)
+  pin = channel.send_message(HEADER)
+  pin.pin()
+  roster.remember(channel.id, pin.id)
+  channel.calls = []
+
+  for user_id in (11, 12, 13):
+    channel.join(user_id)
+    roster.add(channel, user_id)
+  gevent.sleep(0.05)
+
+  assert channel.calls == ['modify']
+  assert pin.content == HEADER + ' <@11> <@12> <@13>'
+
+
+def test_rebuilds_from_overwrites_after_restart(tmpdir):
+  filename = str(tmpdir.join('roster.json'))
+  channel = FakeChannel(5)
+  pin = channel.send_message(HEADER + ' <@11>')
+  pin.pin()
+  pokeroster(HEADER, filename).remember(channel.id, pin.id)
+  channel.join(11)
+  channel.calls = []
+
+  roster = pokeroster(HEADER, filename, window=0.01)
+  channel.join(12)
+  roster.add(channel, 12)
+  gevent.sleep(0.05)
+
+  assert channel.calls == ['modify']
+  assert pin.content == HEADER + ' <@11> <@12>'
+
+
+def test_finds_pin_when_id_unknown():
+  channel = FakeChannel(5)
+  pin = channel.send_message(HEADER)
+  pin.pin()
+  channel.calls = []
+
+  roster = pokeroster(HEADER, window=0.01)
+  channel.join(11)
+  roster.add(channel, 11)
+  gevent.sleep(0.05)
+  assert channel.calls == ['get_pins', 'edit']
+  assert pin.content == HEADER + ' <@11>'
+
+  # From then on it's remembered
+  channel.calls = []
+  channel.join(12)
+  roster.add(channel, 12)
+  gevent.sleep(0.05)
+  assert channel.calls == ['modify']
+  assert pin.content == HEADER + ' <@11> <@12>'
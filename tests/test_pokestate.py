@@ -0,0 +1,102 @@
+import pytest
+import sys
+
+from os.path import dirname
+sys.path.append(dirname(dirname(__file__)))
+
+from conftest import FakeChannel, FakeGuild
+from pokeocr import exRaidData
+from pokestate import pokestate
+
+
+def raid(location='Blair Park'):
+  return exRaidData(month='September', day='9', begin='4:30PM', end='5:15PM', location=location, city='Urbana')
+
+
+@pytest.fixture
+def guild():
+  return FakeGuild([
+    FakeChannel(10, 'ex_raids_9-9'),
+    FakeChannel(11, '9-9_ex_c_champaign_waterfall', members=[100, 101], parent_id=10),
+    FakeChannel(12, '9-9_ex_u_blair_park', members=[101], parent_id=10),
+    FakeChannel(13, 'general', members=[100]),
+  ])
+
+
+def test_guild_loaded(guild):
+  state = pokestate()
+  state.guildLoaded(guild, now=1)
+  assert state.isMember(11, 100)
+  assert not state.isMember(12, 100)
+  # Only raid channels are kept
+  assert not state.isMember(13, 100)
+  assert sorted(state.channelsForUser(101)) == [11, 12]
+
+
+def test_new_raid_and_joins(guild):
+  state = pokestate()
+  state.guildLoaded(guild, now=1)
+
+  channel = guild.add(FakeChannel(14, '9-9_ex_u_beckman_institute', parent_id=10))
+  state.addRaid(channel, raid('Beckman Institute'), now=2)
+  state.setRosterMessageId(14, 500)
+  for (now, user_id) in ((4, 102), (3, 100)):
+    channel.join(user_id)
+    state.addMember(14, user_id, now=now)
+
+  assert state.members(14) == [100, 102]
+  assert state.raid(14) == raid('Beckman Institute')
+  assert state.raid(11) is None
+  assert state.rosterMessageIds() == {14: 500}
+
+  # The gateway's update for our own change keeps the join times
+  state.channelChanged(channel, now=5)
+  assert state.members(14) == [100, 102]
+
+
+def test_channel_events(guild):
+  state = pokestate()
+  state.guildLoaded(guild, now=1)
+
+  guild.channels[11].leave(100)
+  guild.channels[11].join(102)
+  state.channelChanged(guild.channels[11])
+  assert state.members(11) == [101, 102]
+
+  renamed = FakeChannel(12, 'blair_park_chat', members=[101])
+  state.channelChanged(renamed)
+  assert state.channelsForUser(101) == [11]
+
+  state.channelDeleted(11)
+  assert state.channelsForUser(101) == []
+  assert state.members(11) == []
+
+
+def test_failed_change_is_rolled_back(guild):
+  state = pokestate()
+  channel = FakeChannel(14, '9-9_ex_u_beckman_institute', members=[100])
+  with pytest.raises(AttributeError):
+    state.addRaid(channel, exRaidData(month='September', day='9'))
+  assert state.members(14) == []
+
+
+def test_warm_reload(tmpdir, guild):
+  filename = str(tmpdir.join('state.db'))
+  state = pokestate(filename)
+  state.guildLoaded(guild, now=1)
+  state.addRaid(guild.channels[12], raid(), now=1)
+  state.setRosterMessageId(12, 500)
+  state.close()
+
+  # While the bot was down, the waterfall channel was deleted and someone
+  # joined Blair Park
+  del guild.channels[11]
+  guild.channels[12].join(100)
+
+  state = pokestate(filename)
+  assert state.raid(12).location == 'Blair Park'
+  assert state.rosterMessageIds() == {12: 500}
+  state.guildLoaded(guild, now=2)
+  assert state.members(12) == [101, 100]
+  assert state.channelsForUser(100) == [12]
+  assert state.raid(12) == raid()
@@ -0,0 +1,75 @@
+import pytest
+import sys
+import time
+
+from os.path import dirname
+sys.path.append(dirname(dirname(__file__)))
+
+from poketimer import poketimer, logSink, prometheusSink, createTimingSink
+
+
+def test_stages_nest_and_record_in_finish_order():
+  timer = poketimer()
+  with timer.stage('parse'):
+    with timer.stage('dateparse'):
+      time.sleep(0.01)
+  with pytest.raises(ValueError):
+    with timer.stage('ocr'):
+      raise ValueError()
+
+  assert timer.stages.keys() == ['dateparse', 'parse', 'ocr']
+  assert timer.stages['parse'] >= timer.stages['dateparse'] >= 0.01
+  assert not timer.enabled()
+
+
+def test_repeated_stages_add_up():
+  timer = poketimer()
+  for i in range(3):
+    with timer.stage('ocr'):
+      time.sleep(0.01)
+  assert timer.stages.keys() == ['ocr']
+  assert timer.stages['ocr'] >= 0.03
+
+
+def test_emit_passes_timer_to_callback():
+  seen = []
+  timer = poketimer(seen.append)
+  timer.note(match='cache', confidence=(0.91234, 0.8))
+  timer.emit(result='scanned')
+  assert seen == [timer]
+  assert timer.info == {'match': 'cache', 'confidence': (0.91234, 0.8), 'result': 'scanned'}
+
+
+def test_log_sink(capsys):
+  timer = poketimer(logSink)
+  with timer.stage('ocr'):
+    pass
+  timer.emit(confidence=(0.91234, 0.8), result='scanned')
+  line = capsys.readouterr()[0]
+  assert line.startswith('timings ocr=0.000 total=')
+  assert line.rstrip().endswith(' confidence=0.912,0.800 result=scanned')
+
+
+def test_prometheus_sink(tmpdir):
+  filename = str(tmpdir.join('timings.prom'))
+  sink = prometheusSink(filename)
+  for result in ('scanned', 'scanned', 'invalid_city'):
+    timer = poketimer(sink)
+    with timer.stage('ocr'):
+      pass
+    timer.emit(result=result)
+
+  # Only the first emit writes, the rest wait for the interval
+  sink.write()
+  text = open(filename).read()
+  assert 'exraidbot_stage_seconds_count{stage="ocr"} 3' in text
+  assert 'exraidbot_stage_seconds_bucket{stage="ocr",le="0.01"} 3' in text
+  assert 'exraidbot_invites_total{result="scanned"} 2' in text
+  assert 'exraidbot_invites_total{result="invalid_city"} 1' in text
+
+
+def test_create_timing_sink():
+  assert createTimingSink(None) is None
+  assert createTimingSink('log') is logSink
+  assert createTimingSink('prometheus') is None
+  assert isinstance(createTimingSink('prometheus', 'timings.prom'), prometheusSink)
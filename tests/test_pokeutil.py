@@ -0,0 +1,38 @@
+import os
+import pytest
+import sys
+
+from os.path import dirname
+sys.path.append(dirname(dirname(__file__)))
+
+from pokeutil import histogram, writeAtomically
+
+
+def test_write_atomically(tmpdir):
+  filename = str(tmpdir.join('state.json'))
+  writeAtomically(filename, 'old')
+  writeAtomically(filename, 'new')
+  assert open(filename).read() == 'new'
+  assert os.listdir(str(tmpdir)) == ['state.json']
+
+
+def test_failed_write_leaves_the_old_file(tmpdir):
+  filename = str(tmpdir.join('state.json'))
+  writeAtomically(filename, 'old')
+  with pytest.raises(TypeError):
+    writeAtomically(filename, None)
+  assert open(filename).read() == 'old'
+  assert os.listdir(str(tmpdir)) == ['state.json']
+
+
+def test_histogram():
+  latency = histogram((0.1, 1.0))
+  for seconds in (0.05, 0.1, 0.5, 2.0):
+    latency.record(seconds)
+  assert latency.render('latency_seconds', 'stage="ocr"') == [
+    'latency_seconds_bucket{stage="ocr",le="0.1"} 2',
+    'latency_seconds_bucket{stage="ocr",le="1.0"} 3',
+    'latency_seconds_bucket{stage="ocr",le="+Inf"} 4',
+    'latency_seconds_sum{stage="ocr"} 2.650000',
+    'latency_seconds_count{stage="ocr"} 4',
+  ]
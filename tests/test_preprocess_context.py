@@ -0,0 +1,48 @@
+import pytest
+import sys
+import os
+import numpy as np
+import cv2
+
+from os.path import dirname
+sys.path.append(dirname(dirname(__file__)))
+
+from cv2utils import cv2utils, preprocessContext
+
+TOPLEFT = os.path.join(dirname(dirname(os.path.abspath(__file__))), 'topleft.png')
+
+
+def images():
+  image = cv2.imread(TOPLEFT)
+  # Big, small and odd-sized, so buffers are both grown and reused
+  return [cv2.resize(image, (0, 0), fx=2, fy=2), image, image[3:-5, 1:-2]]
+
+
+def test_same_results_as_cv2utils():
+  context = preprocessContext()
+  for image in images():
+    assert (context.increaseContrast(image) == cv2utils.increaseContrast(image)).all()
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    assert (context.gray(image) == gray).all()
+    assert (context.increaseGrayContrast(gray) == cv2utils.increaseGrayContrast(gray)).all()
+    expected = cv2.resize(image, (0, 0), fx=3, fy=3, interpolation=cv2.INTER_CUBIC)
+    assert (context.resize(image, 3, cv2.INTER_CUBIC) == expected).all()
+
+
+def test_buffers_are_reused():
+  context = preprocessContext()
+  (big, small, odd) = images()
+  context.increaseContrast(big)
+  buffers = dict(context.buffers)
+  context.increaseContrast(small)
+  context.increaseContrast(odd)
+  assert all([context.buffers[name] is buf for name, buf in buffers.iteritems()])
+
+
+def test_results_outlive_the_next_call():
+  context = preprocessContext()
+  (big, small, odd) = images()
+  first = context.increaseContrast(small)
+  kept = first.copy()
+  context.increaseContrast(odd)
+  assert (first == kept).all()
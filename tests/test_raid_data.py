@@ -0,0 +1,54 @@
+import pytest
+import sys
+import json
+import pickle
+
+from os.path import dirname
+sys.path.append(dirname(dirname(__file__)))
+
+from pokeocr import exRaidData, parse_time
+
+
+def raid():
+  return exRaidData(month='September', day='9', begin='5:00PM', end='5:45PM', location='Blair Park', city='Urbana')
+
+
+def test_strings_are_stored_as_numbers():
+  info = raid()
+  assert (info.monthNumber, info.dayNumber, info.beginMinutes, info.endMinutes) == (9, 9, 1020, 1065)
+  assert (info.month, info.day, info.begin, info.end) == ('September', '9', '5:00PM', '5:45PM')
+
+  info = exRaidData(monthNumber=1, dayNumber=12, beginMinutes=660, endMinutes=705)
+  assert (info.month, info.day, info.begin, info.end) == ('January', '12', '11:00AM', '11:45AM')
+
+
+def test_missing_fields_raise_attribute_error():
+  info = exRaidData(month='September', day='9', location='Blair Park')
+  with pytest.raises(AttributeError):
+    info.city
+  with pytest.raises(AttributeError):
+    info.unknown = 1
+  assert 'city' not in info.toDict()
+
+
+def test_bad_values():
+  with pytest.raises(ValueError):
+    exRaidData(month='Smarch')
+  with pytest.raises(ValueError):
+    exRaidData(begin='25:00')
+  assert parse_time('17:00') == parse_time('5:00 PM') == parse_time('5:0OPM') == 1020
+
+
+def test_round_trips():
+  info = raid()
+  info.confidence = (0.91, 0.88)
+  info.timings = {'ocr': 0.5}
+
+  data = json.loads(json.dumps(info.toDict()))
+  assert data['monthNumber'] == 9 and 'month' not in data
+  again = exRaidData.fromDict(data)
+  assert again.begin == '5:00PM' and again.confidence == [0.91, 0.88] and again.timings == {'ocr': 0.5}
+
+  assert pickle.loads(pickle.dumps(info, pickle.HIGHEST_PROTOCOL)) == info
+  assert pickle.loads(pickle.dumps(info)) == info
+  assert info.copy() == info and info.copy() is not info
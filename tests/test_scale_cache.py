@@ -0,0 +1,34 @@
+import pytest
+import sys
+import os
+import json
+import cv2
+
+from os.path import dirname
+sys.path.append(dirname(dirname(__file__)))
+
+from cv2utils import scalingTemplate
+from pokeocr import pokeocr
+
+ROOT = dirname(dirname(os.path.abspath(__file__)))
+INVITE = os.path.join(ROOT, 'test_images', 'Champaign_IL', 'Blair-Park', '20180902_Invite001.png')
+
+
+@pytest.fixture
+def ocr():
+  config = os.path.join(ROOT, 'config', 'exraid.json')
+  with open(config) as fp:
+    regex = json.load(fp)['location_regular_expression']
+  return pokeocr(regex, config_file=config)
+
+
+def test_cache_hits_crop_the_same_and_leave_the_cache_alone(ocr):
+  templates = [scalingTemplate.fromFile(os.path.join(ROOT, name)) for name in ('topleft.png', 'bottom.png')]
+  image = cv2.imread(INVITE)
+
+  first = ocr.cropExRaidImage(image, *templates)
+  entries = json.dumps(ocr.scale_cache.entries)
+  ocr.scale_cache.save = lambda: pytest.fail('the cache should only be saved after a full search')
+  for i in range(4):
+    assert ocr.cropExRaidImage(image, *templates).shape == first.shape
+  assert json.dumps(ocr.scale_cache.entries) == entries
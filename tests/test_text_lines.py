@@ -0,0 +1,44 @@
+import pytest
+import sys
+import numpy as np
+import cv2
+
+from os.path import dirname
+sys.path.append(dirname(dirname(__file__)))
+
+from cv2utils import cv2utils
+
+SLATE = (114, 107, 74)
+GRAY = (140, 140, 140)
+TEAL = (166, 196, 46)
+
+
+# Draws a card like the bottom of an invite: date, gym name, city and the
+# Get directions button
+def card(gym_lines=1):
+  image = np.full((300 + 40 * gym_lines, 800, 3), 255, np.uint8)
+  cv2.putText(image, 'September 9 4:30 PM - 5:15 PM', (100, 80), cv2.FONT_HERSHEY_SIMPLEX, 1.2, SLATE, 3)
+  y = 170
+  for i in range(gym_lines):
+    cv2.putText(image, 'Beckman Institute', (120, y), cv2.FONT_HERSHEY_SIMPLEX, 1.1, SLATE, 3)
+    y += 45
+  cv2.putText(image, 'Urbana, Illinois, United States', (150, y), cv2.FONT_HERSHEY_SIMPLEX, 0.9, GRAY, 2)
+  cv2.putText(image, 'Get directions', (250, y + 55), cv2.FONT_HERSHEY_SIMPLEX, 1.1, TEAL, 3)
+  return image
+
+
+def test_finds_lines_but_not_the_button():
+  lines = cv2utils.textLines(card())
+  assert len(lines) == 3
+  (top, bottom, left, right) = lines[0]
+  assert top < 80 - 25 and bottom > 80 and left < 100 and right > 500
+  # The city is the last line, above the button
+  assert lines[2][0] < 170 + 45 and lines[2][1] < 170 + 45 + 40
+
+
+def test_wrapped_gym_name():
+  assert len(cv2utils.textLines(card(gym_lines=2))) == 4
+
+
+def test_blank():
+  assert cv2utils.textLines(np.full((200, 400, 3), 255, np.uint8)) == []